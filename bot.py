@@ -3,12 +3,19 @@ import logging
 from aiogram import Bot, Dispatcher
 from aiogram.enums.parse_mode import ParseMode
 from aiogram.client.default import DefaultBotProperties
+from aiogram.fsm.storage.memory import DisabledEventIsolation
 from dotenv import load_dotenv
 
 load_dotenv() # Загружаем переменные из .env файла
 
-from config import TOKEN
-from db import init_db, init_days
+from config import TOKEN, MEDIA_PREWARM_CHAT_ID
+from db import init_db, init_days, listen_days_changes, stop_listening_days_changes, close_storage
+from fsm_storage import DBStorage, FSMUpdateMiddleware, watch_idle_sessions
+from media import prewarm
+from user_queue import UserQueueMiddleware
+from memes import build_index as build_meme_index, watch_index as watch_meme_index
+import leaderboard
+import certificate
 from handlers import router as main_router
 from day1_handler import router as day1_router
 from day2_handler import router as day2_router
@@ -19,25 +26,56 @@ from day5_handler import router as day5_router
 async def main():
     logging.basicConfig(level=logging.INFO)
     print("LOG: Инициализация...")
-    await init_db()
-    await init_days() # Инициализируем дни
-
-    bot = Bot(token=TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
-    print("LOG: Bot создан")
-    
-    dp = Dispatcher()
-    dp.include_router(day1_router)
-    dp.include_router(day2_router)
-    dp.include_router(day3_router)
-    dp.include_router(day4_router)
-    dp.include_router(day5_router)
-    dp.include_router(main_router) # Этот роутер должен быть последним
-    print("LOG: Роутеры подключены")
-
-    print("LOG: Запуск polling...")
-    await bot.delete_webhook(drop_pending_updates=True)
-    await dp.start_polling(bot)
-    print("LOG: Polling завершился")
+    watchers: list[asyncio.Task] = []
+    bot = None
+    # Очистка в finally выполняется и при ошибке или отмене на любом шаге: иначе SQLite
+    # не зафиксирует отложенные записи, а соединения с БД останутся открытыми
+    try:
+        await init_db()
+        await init_days() # Инициализируем дни
+        await build_meme_index()
+        await leaderboard.reload()
+        certificate.check_font()
+        await listen_days_changes() # Кэш открытых дней сбрасывается по NOTIFY от любой копии бота
+
+        bot = Bot(token=TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+        print("LOG: Bot создан")
+
+        # Состояния FSM хранятся в БД: переживают перезапуск и общие для всех копий бота.
+        # Встроенный FSM-middleware заменен на FSMUpdateMiddleware: одно чтение и не больше
+        # одной записи состояния за обновление
+        fsm_storage = DBStorage()
+        dp = Dispatcher(storage=fsm_storage, disable_fsm=True)
+        # Обновления одного пользователя обрабатываются по очереди; очередь стоит раньше FSM,
+        # чтобы следующее обновление читало уже сохраненное состояние
+        dp.update.outer_middleware(UserQueueMiddleware())
+        dp.update.outer_middleware(FSMUpdateMiddleware(fsm_storage, events_isolation=DisabledEventIsolation()))
+        dp.include_router(day1_router)
+        dp.include_router(day2_router)
+        dp.include_router(day3_router)
+        dp.include_router(day4_router)
+        dp.include_router(day5_router)
+        dp.include_router(main_router) # Этот роутер должен быть последним
+        print("LOG: Роутеры подключены")
+
+        if MEDIA_PREWARM_CHAT_ID:
+            await prewarm(bot, MEDIA_PREWARM_CHAT_ID)
+
+        watchers.append(asyncio.create_task(watch_meme_index()))
+        watchers.append(asyncio.create_task(leaderboard.watch()))
+        watchers.append(asyncio.create_task(watch_idle_sessions()))
+
+        print("LOG: Запуск polling...")
+        await bot.delete_webhook(drop_pending_updates=True)
+        await dp.start_polling(bot)
+    finally:
+        for watcher in watchers:
+            watcher.cancel()
+        await stop_listening_days_changes()
+        await close_storage()
+        if bot is not None:
+            await bot.session.close()
+        print("LOG: Polling завершился")
 
 if __name__ == '__main__':
     print("LOG: Старт main()")
@@ -0,0 +1,208 @@
+"""
+Сборка оптимизированных вариантов медиафайлов для отправки в Telegram.
+
+Telegram все равно пережимает фото до 1280 px по большей стороне, поэтому исходные
+PNG уменьшаются до этого размера и сохраняются в JPEG. Видео перепаковываются без
+перекодирования с moov-атомом в начале файла (faststart), чтобы клиент мог начать
+воспроизведение до окончания загрузки; для них также сохраняется превью и размеры.
+
+Результаты складываются в каталог build/assets под именем, зависящим от содержимого.
+Соответствие исходный файл -> результат записывается в manifest.json, через который
+media.py выбирает файл для отправки.
+
+Запуск: python build_assets.py [каталоги или файлы ...]
+"""
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+BUILD_DIR = "build/assets"
+MANIFEST_PATH = os.path.join(BUILD_DIR, "manifest.json")
+DEFAULT_SOURCES = ("img/comics", "img/heroes", "img/certificate", "video")
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg")
+VIDEO_EXTENSIONS = (".mp4",)
+
+# Параметры фото в Telegram: большая сторона не больше 1280 px
+PHOTO_MAX_SIDE = 1280
+JPEG_QUALITY = 87
+# Превью видео в Telegram: JPEG не больше 320 px по большей стороне
+THUMBNAIL_MAX_SIDE = 320
+# Версия параметров сборки входит в хэш, чтобы при их изменении файлы пересобирались
+BUILD_PARAMS = f"jpeg:{PHOTO_MAX_SIDE}:{JPEG_QUALITY}"
+VIDEO_BUILD_PARAMS = f"faststart:thumb{THUMBNAIL_MAX_SIDE}"
+
+
+def load_manifest() -> dict:
+    try:
+        with open(MANIFEST_PATH, encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def save_manifest(manifest: dict):
+    os.makedirs(BUILD_DIR, exist_ok=True)
+    tmp_path = MANIFEST_PATH + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2, sort_keys=True)
+    os.replace(tmp_path, MANIFEST_PATH)
+
+
+def collect_sources(paths) -> list[str]:
+    sources = []
+    for path in paths:
+        if os.path.isfile(path):
+            sources.append(path)
+            continue
+        for root, _, files in os.walk(path):
+            sources.extend(os.path.join(root, name) for name in sorted(files) if name.lower().endswith(IMAGE_EXTENSIONS + VIDEO_EXTENSIONS))
+    return sources
+
+
+def is_video(path: str) -> bool:
+    return path.lower().endswith(VIDEO_EXTENSIONS)
+
+
+def is_up_to_date(path: str, entry: dict | None) -> bool:
+    """Файл не менялся с прошлой сборки и результат сборки на месте."""
+    params = VIDEO_BUILD_PARAMS if is_video(path) else BUILD_PARAMS
+    if not entry or entry.get("params") != params:
+        return False
+    stat = os.stat(path)
+    return (
+        entry.get("mtime_ns") == stat.st_mtime_ns
+        and entry.get("bytes_in") == stat.st_size
+        and os.path.exists(entry.get("output", ""))
+    )
+
+
+def optimize_image(path: str) -> dict:
+    """Уменьшает и пережимает одно изображение. Выполняется в отдельном процессе."""
+    from PIL import Image
+
+    stat = os.stat(path)
+    with open(path, "rb") as f:
+        content = f.read()
+    digest = hashlib.sha256(content + BUILD_PARAMS.encode()).hexdigest()[:20]
+    output = os.path.join(BUILD_DIR, f"{digest}.jpg")
+
+    if not os.path.exists(output):
+        with Image.open(path) as image:
+            image.thumbnail((PHOTO_MAX_SIDE, PHOTO_MAX_SIDE), Image.LANCZOS)
+            if image.mode in ("RGBA", "LA", "P"):
+                image = image.convert("RGBA")
+                background = Image.new("RGB", image.size, (255, 255, 255))
+                background.paste(image, mask=image.getchannel("A"))
+                image = background
+            elif image.mode != "RGB":
+                image = image.convert("RGB")
+            tmp_output = output + ".tmp"
+            image.save(tmp_output, "JPEG", quality=JPEG_QUALITY, optimize=True, progressive=True)
+            os.replace(tmp_output, output)
+
+    return {
+        "output": output,
+        "params": BUILD_PARAMS,
+        "mtime_ns": stat.st_mtime_ns,
+        "bytes_in": stat.st_size,
+        "bytes_out": os.path.getsize(output),
+    }
+
+
+def _probe_video(path: str) -> dict:
+    """Читает размеры и длительность видео через ffprobe."""
+    result = subprocess.run(
+        ["ffprobe", "-v", "error", "-select_streams", "v:0",
+         "-show_entries", "stream=width,height:format=duration", "-of", "json", path],
+        capture_output=True, check=True, text=True,
+    )
+    info = json.loads(result.stdout)
+    stream = info["streams"][0]
+    return {
+        "width": int(stream["width"]),
+        "height": int(stream["height"]),
+        "duration": round(float(info["format"]["duration"])),
+    }
+
+
+def prepare_video(path: str) -> dict:
+    """Перепаковывает видео с faststart и извлекает превью. Выполняется в отдельном процессе."""
+    stat = os.stat(path)
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    digest.update(VIDEO_BUILD_PARAMS.encode())
+    name = digest.hexdigest()[:20]
+    output = os.path.join(BUILD_DIR, f"{name}.mp4")
+    thumbnail = os.path.join(BUILD_DIR, f"{name}_thumb.jpg")
+
+    if not os.path.exists(output):
+        tmp_output = output + ".tmp.mp4"
+        subprocess.run(
+            ["ffmpeg", "-y", "-v", "error", "-i", path, "-c", "copy", "-movflags", "+faststart", tmp_output],
+            check=True,
+        )
+        os.replace(tmp_output, output)
+    if not os.path.exists(thumbnail):
+        scale = f"scale={THUMBNAIL_MAX_SIDE}:{THUMBNAIL_MAX_SIDE}:force_original_aspect_ratio=decrease"
+        subprocess.run(
+            ["ffmpeg", "-y", "-v", "error", "-ss", "1", "-i", path, "-frames:v", "1", "-vf", scale, "-q:v", "4", thumbnail],
+            check=True,
+        )
+
+    return {
+        "output": output,
+        "thumbnail": thumbnail,
+        "params": VIDEO_BUILD_PARAMS,
+        "mtime_ns": stat.st_mtime_ns,
+        "bytes_in": stat.st_size,
+        "bytes_out": os.path.getsize(output),
+        **_probe_video(output),
+    }
+
+
+def _build_one(path: str) -> dict:
+    return prepare_video(path) if is_video(path) else optimize_image(path)
+
+
+def build(paths) -> dict:
+    manifest = load_manifest()
+    sources = collect_sources(paths)
+    if not shutil.which("ffmpeg") or not shutil.which("ffprobe"):
+        skipped = [path for path in sources if is_video(path)]
+        if skipped:
+            print(f"ffmpeg не найден, видео пропущены: {len(skipped)}")
+            sources = [path for path in sources if not is_video(path)]
+    pending = [path for path in sources if not is_up_to_date(path, manifest.get(path))]
+    print(f"Найдено файлов: {len(sources)}, к сборке: {len(pending)}")
+
+    os.makedirs(BUILD_DIR, exist_ok=True)
+    with ProcessPoolExecutor() as executor:
+        for path, entry in zip(pending, executor.map(_build_one, pending)):
+            manifest[path] = entry
+
+    total_in = total_out = 0
+    for path in sources:
+        entry = manifest[path]
+        saved = entry["bytes_in"] - entry["bytes_out"]
+        total_in += entry["bytes_in"]
+        total_out += entry["bytes_out"]
+        print(f"{path}: {entry['bytes_in'] / 1024:.0f} КБ -> {entry['bytes_out'] / 1024:.0f} КБ (сэкономлено {saved / 1024:.0f} КБ, {saved / entry['bytes_in']:.0%})")
+    if sources:
+        print(f"Итого: {total_in / 1024 / 1024:.1f} МБ -> {total_out / 1024 / 1024:.1f} МБ")
+
+    save_manifest(manifest)
+    return manifest
+
+
+if __name__ == "__main__":
+    try:
+        import PIL  # noqa: F401
+    except ImportError:
+        sys.exit("Для сборки изображений нужен Pillow: pip install Pillow")
+    build(sys.argv[1:] or DEFAULT_SOURCES)
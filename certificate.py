@@ -0,0 +1,276 @@
+"""
+Персональные сертификаты: имя участника, баллы и дата поверх шаблона.
+
+Отрисовка выполняется в пуле процессов, готовые файлы хранятся в build/certificates
+под именем {user_id}_{хэш данных}.jpg, поэтому повторный запрос с теми же данными
+не рисует сертификат заново, а media.py отправляет его по сохраненному file_id.
+
+Пакетная отрисовка для всех, кто выполнил условия: python certificate.py --batch
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from dotenv import load_dotenv
+
+load_dotenv() # Нужно и при запуске из командной строки, до импорта config
+
+from config import (
+    CERTIFICATE_MIN_POINTS, CERTIFICATE_DATE, CERTIFICATE_FONT,
+    CERTIFICATE_CACHE_MAX_MB, CERTIFICATE_WORKERS,
+)
+
+TEMPLATE_PATH = "img/certificate/Сертификат_Мастер коммникаций.png"
+OUTPUT_DIR = "build/certificates"
+# Меняется при изменении разметки, чтобы старые сертификаты перерисовались
+LAYOUT_VERSION = 1
+
+# Положение текста в долях от размеров шаблона (левая синяя панель под описанием)
+TEXT_LEFT = 0.066
+NAME_TOP = 0.735
+DETAILS_TOP = 0.81
+NAME_SIZE = 0.028
+DETAILS_SIZE = 0.012
+NAME_MAX_WIDTH = 0.35
+TEXT_COLOR = (255, 255, 255)
+
+_executor: ProcessPoolExecutor | None = None
+
+
+def is_eligible(profile: dict | None, day5_progress: dict | None) -> bool:
+    """Условия сертификата: пройдены квиз и рефлексия Дня 5 и набрано достаточно баллов."""
+    if not profile or not day5_progress:
+        return False
+    return (
+        day5_progress.get("quiz_completed", False)
+        and day5_progress.get("reflection_completed", False)
+        and profile.get("points", 0) >= CERTIFICATE_MIN_POINTS
+    )
+
+
+def display_name(profile: dict) -> str:
+    return profile.get("full_name") or profile.get("username") or str(profile["id"])
+
+
+def certificate_date() -> str:
+    return CERTIFICATE_DATE or date.today().strftime("%d.%m.%Y")
+
+
+def _load_font(size: int):
+    from PIL import ImageFont
+    try:
+        return ImageFont.truetype(CERTIFICATE_FONT, size)
+    except OSError as e:
+        # Встроенный шрифт Pillow не содержит кириллицы: имя и баллы превратились бы в квадраты
+        raise RuntimeError(f"Не найден шрифт сертификата {CERTIFICATE_FONT}, задайте CERTIFICATE_FONT") from e
+
+
+def check_font() -> bool:
+    """Проверяет при запуске, что шрифт сертификата доступен, чтобы не узнать об этом от участников."""
+    try:
+        _load_font(12)
+    except RuntimeError as e:
+        logging.error(f"{e}. Сертификаты не будут отрисовываться.")
+        return False
+    return True
+
+
+def _render(output_path: str, name: str, points: int, date_text: str) -> str:
+    """Рисует сертификат в файл. Выполняется в отдельном процессе."""
+    from PIL import Image, ImageDraw
+
+    with Image.open(TEMPLATE_PATH) as template:
+        image = template.convert("RGB")
+    width, height = image.size
+    draw = ImageDraw.Draw(image)
+
+    # Длинные имена уменьшаем, чтобы они не вылезали за пределы панели
+    name_size = int(height * NAME_SIZE * 2)
+    name_font = _load_font(name_size)
+    while draw.textlength(name, font=name_font) > width * NAME_MAX_WIDTH and name_size > 12:
+        name_size -= 2
+        name_font = _load_font(name_size)
+    draw.text((width * TEXT_LEFT, height * NAME_TOP), name, font=name_font, fill=TEXT_COLOR)
+
+    details = f"Баллы: {points}  ·  {date_text}"
+    draw.text((width * TEXT_LEFT, height * DETAILS_TOP), details, font=_load_font(int(height * DETAILS_SIZE * 2)), fill=TEXT_COLOR)
+
+    # Свое временное имя у каждой отрисовки: пакетная и запрос из бота могут рисовать один файл одновременно
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(output_path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            image.save(f, "JPEG", quality=90, optimize=True)
+        os.replace(tmp_path, output_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return output_path
+
+
+# Готовые файлы в OUTPUT_DIR: путь -> размер, и пути по user_id. Каталог читается один раз,
+# дальше индекс обновляется при отрисовке и удалении файлов
+_files: dict[str, int] | None = None
+_user_files: dict[int, set[str]] = {}
+_total_size = 0
+# Индекс меняется в потоках asyncio.to_thread, поэтому доступ к нему по очереди
+_index_lock = asyncio.Lock()
+# Вытеснение освобождает место с запасом, чтобы не запускаться после каждой отрисовки
+EVICT_TARGET = 0.9
+
+
+def _owner(path: str) -> int | None:
+    prefix = os.path.basename(path).split("_", 1)[0]
+    return int(prefix) if prefix.isdigit() else None
+
+
+def _add(path: str, size: int):
+    global _total_size
+    _total_size += size - _files.get(path, 0)
+    _files[path] = size
+    user_id = _owner(path)
+    if user_id is not None:
+        _user_files.setdefault(user_id, set()).add(path)
+
+
+def _remove(path: str):
+    global _total_size
+    _total_size -= _files.pop(path, 0)
+    user_id = _owner(path)
+    paths = _user_files.get(user_id)
+    if paths is not None:
+        paths.discard(path)
+        if not paths:
+            del _user_files[user_id]
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass # Файл уже удалил другой процесс
+
+
+def _scan():
+    """Перечитывает каталог: файлы могли добавить или удалить другие процессы."""
+    global _files, _total_size
+    _files, _total_size = {}, 0
+    _user_files.clear()
+    with os.scandir(OUTPUT_DIR) as entries:
+        for entry in entries:
+            if not entry.name.endswith(".jpg"):
+                continue
+            try:
+                _add(entry.path, entry.stat().st_size)
+            except FileNotFoundError:
+                continue
+
+
+def _register(user_id: int, path: str) -> list[str]:
+    """Учитывает новый сертификат и удаляет прежние сертификаты пользователя. Возвращает удаленные пути."""
+    if _files is None:
+        _scan()
+    removed = [old_path for old_path in _user_files.get(user_id, ()) if old_path != path]
+    for old_path in removed:
+        _remove(old_path)
+    _add(path, os.path.getsize(path))
+    return removed
+
+
+def _evict(keep: set[str]) -> list[str]:
+    """Удаляет самые старые файлы, пока каталог не уменьшится до EVICT_TARGET от лимита."""
+    limit = CERTIFICATE_CACHE_MAX_MB * 1024 * 1024
+    _scan()
+    if _total_size <= limit:
+        return []
+    entries = []
+    for path in _files:
+        try:
+            entries.append((os.path.getmtime(path), path))
+        except FileNotFoundError:
+            continue
+    removed = []
+    for _, path in sorted(entries):
+        if _total_size <= limit * EVICT_TARGET:
+            break
+        if path not in keep:
+            _remove(path)
+            removed.append(path)
+    return removed
+
+
+async def _forget_removed(paths: list[str]):
+    """Удаляет из кэша file_id записи удаленных сертификатов: по этим путям они больше не понадобятся."""
+    import media
+    await media.forget_files(paths)
+
+
+async def evict_over_limit(keep: set[str] = frozenset()) -> int:
+    """Освобождает место в каталоге сертификатов, если он превысил CERTIFICATE_CACHE_MAX_MB."""
+    async with _index_lock:
+        removed = await asyncio.to_thread(_evict, keep)
+    await _forget_removed(removed)
+    if removed:
+        print(f"LOG: Удалено старых сертификатов: {len(removed)}")
+    return len(removed)
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=CERTIFICATE_WORKERS)
+    return _executor
+
+
+async def get_certificate(profile: dict, evict: bool = True) -> str:
+    """
+    Возвращает путь к сертификату пользователя, отрисовывая его только при изменении данных.
+    evict=False откладывает вытеснение старых файлов: пакетная отрисовка делает его один раз в конце.
+    """
+    name = display_name(profile)
+    points = profile.get("points", 0)
+    # Дата выдачи в ключ не входит: иначе без CERTIFICATE_DATE сертификаты перерисовывались бы каждый день
+    profile_hash = hashlib.sha256(f"{LAYOUT_VERSION}|{name}|{points}|{CERTIFICATE_DATE or ''}".encode()).hexdigest()[:16]
+    output_path = os.path.join(OUTPUT_DIR, f"{profile['id']}_{profile_hash}.jpg")
+
+    if not os.path.exists(output_path):
+        os.makedirs(OUTPUT_DIR, exist_ok=True)
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(_get_executor(), _render, output_path, name, points, certificate_date())
+        async with _index_lock:
+            removed = await asyncio.to_thread(_register, profile["id"], output_path)
+        await _forget_removed(removed)
+        print(f"LOG: Отрисован сертификат для пользователя ID={profile['id']}")
+        if evict and _total_size > CERTIFICATE_CACHE_MAX_MB * 1024 * 1024:
+            await evict_over_limit({output_path})
+    return output_path
+
+
+async def render_all():
+    """Заранее отрисовывает сертификаты всем, кто выполнил условия."""
+    import db
+    if not check_font():
+        return
+    candidates = await db.get_certificate_candidates(CERTIFICATE_MIN_POINTS)
+    print(f"LOG: Сертификатов к отрисовке: {len(candidates)}")
+    semaphore = asyncio.Semaphore(CERTIFICATE_WORKERS)
+    done = 0
+
+    async def render_one(profile):
+        nonlocal done
+        async with semaphore:
+            await get_certificate(profile, evict=False)
+        done += 1
+        if done % 50 == 0:
+            print(f"LOG: Отрисовано {done}/{len(candidates)}")
+
+    await asyncio.gather(*(render_one(profile) for profile in candidates))
+    if os.path.isdir(OUTPUT_DIR):
+        await evict_over_limit()
+    print("LOG: Пакетная отрисовка сертификатов завершена.")
+
+
+if __name__ == "__main__":
+    if "--batch" not in sys.argv:
+        sys.exit("Использование: python certificate.py --batch")
+    asyncio.run(render_all())
@@ -14,4 +14,10 @@ ADMIN_COMMANDS_TEXT = (
     "/closeday - Закрыть последний открытый день\n"
     "/setday <номер> - Установить текущий день марафона\n"
     "/def <user_id> - Сбросить прогресс пользователя\n"
+    "/mediastats - Статистика загрузки медиафайлов\n"
+    "/dbstats - Статистика кэшей и запросов к базе данных\n"
+    "/fsmstats - Число и размер сессий FSM\n"
+    "/queues - Очереди обновлений пользователей: длина и время ожидания\n"
+    "/recalcpoints - Пересчитать баллы всех пользователей по журналу начислений\n"
+    "/export - Выгрузить пользователей, баллы, результаты и рефлексии в CSV\n"
 )
\ No newline at end of file
@@ -9,10 +9,65 @@ DB_USER = os.getenv("DB_USER")
 DB_PASS = os.getenv("DB_PASS")
 DB_NAME = os.getenv("DB_NAME")
 
+# --- Хранилище данных ---
+# postgres — основной режим; sqlite — файл без сервера БД для небольших пилотов;
+# memory — данные только в памяти процесса, для нагрузочных тестов обработчиков
+DB_BACKEND = os.getenv("DB_BACKEND", "postgres")
+SQLITE_PATH = os.getenv("SQLITE_PATH", "db.sqlite")
+# SQLite фиксирует записи пачками: не реже чем раз в указанное число секунд
+# или сразу после указанного числа записей
+SQLITE_COMMIT_INTERVAL = float(os.getenv("SQLITE_COMMIT_INTERVAL", 0.05))
+SQLITE_COMMIT_BATCH = int(os.getenv("SQLITE_COMMIT_BATCH", 200))
+# Пауза (в секундах) перед повторной подпиской на изменения дней после обрыва LISTEN:
+# начинается с первого значения и удваивается до второго
+DAYS_LISTEN_RETRY_MIN = 1
+DAYS_LISTEN_RETRY_MAX = 60
+# Данные состояния FSM больше этого размера (в байтах) сохраняются сжатыми
+FSM_COMPRESS_MIN_SIZE = 256
+# Бюджет на данные состояния одного пользователя (в байтах после кодирования); превышения
+# попадают в лог и в отчет /fsmstats
+FSM_DATA_BUDGET = 1024
+# Сессии FSM без изменений дольше FSM_SESSION_TTL секунд удаляются: вернувшийся пользователь
+# начнет тест или комикс заново, прогресс дней и баллы не затрагиваются.
+# Проверка раз в FSM_EXPIRE_INTERVAL секунд
+FSM_SESSION_TTL = int(os.getenv("FSM_SESSION_TTL", 7 * 24 * 3600))
+FSM_EXPIRE_INTERVAL = int(os.getenv("FSM_EXPIRE_INTERVAL", 3600))
+
 # --- Общие настройки ---
 
 # Количество дней мероприятия или теста
 EVENT_DAYS = 5
+# Как часто (в секундах) сверять рейтинг участников с БД
+LEADERBOARD_RECONCILE_INTERVAL = int(os.getenv("LEADERBOARD_RECONCILE_INTERVAL", 300))
+# Сколько участников показывать в топе
+LEADERBOARD_TOP_SIZE = 10
+# Сколько id пользователей держать в памяти, чтобы не повторять запрос на их создание
+KNOWN_USERS_CACHE_SIZE = int(os.getenv("KNOWN_USERS_CACHE_SIZE", 100_000))
+
+
+# --- Медиафайлы ---
+
+# Служебный чат, в который при старте заранее загружаются все медиафайлы,
+# чтобы получить их file_id до первого пользователя. Пусто — прогрев отключен.
+MEDIA_PREWARM_CHAT_ID = int(os.getenv("MEDIA_PREWARM_CHAT_ID")) if os.getenv("MEDIA_PREWARM_CHAT_ID") else None
+# Сколько файлов загружается одновременно
+MEDIA_PREWARM_CONCURRENCY = int(os.getenv("MEDIA_PREWARM_CONCURRENCY", 4))
+# Максимальное время прогрева в секундах, после которого бот все равно начинает polling
+MEDIA_PREWARM_TIMEOUT = int(os.getenv("MEDIA_PREWARM_TIMEOUT", 300))
+
+
+# --- Сертификат ---
+
+# Минимум баллов для получения сертификата (вместе с квизом и рефлексией Дня 5)
+CERTIFICATE_MIN_POINTS = 60
+# Дата, которая печатается на сертификате. Пусто — дата первой отрисовки сертификата
+CERTIFICATE_DATE = os.getenv("CERTIFICATE_DATE")
+# Шрифт с поддержкой кириллицы для имени и баллов
+CERTIFICATE_FONT = os.getenv("CERTIFICATE_FONT", "DejaVuSans.ttf")
+# Предельный размер каталога с готовыми сертификатами, старые файлы удаляются
+CERTIFICATE_CACHE_MAX_MB = int(os.getenv("CERTIFICATE_CACHE_MAX_MB", 500))
+# Количество процессов для отрисовки сертификатов
+CERTIFICATE_WORKERS = int(os.getenv("CERTIFICATE_WORKERS", 2))
 
 
 # Список Telegram ID администраторов бота (укажите свои ID)
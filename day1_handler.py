@@ -5,6 +5,7 @@ from aiogram.fsm.context import FSMContext
 import db
 import texts
 import keyboards
+import media
 from states import TestStates
 from utils import safe_delete_message # Импортируем из общего хендлера
 
@@ -19,8 +20,9 @@ def parse_idx(cb_data: str) -> int | None:
 
 async def start_day1(message: types.Message, state: FSMContext):
     await state.set_state(TestStates.CHOOSE_TEST)
-    await message.answer_photo(
-        photo=types.FSInputFile("img/День 1.png"),
+    await media.answer_photo(
+        message,
+        "img/День 1.png",
         caption="День 1: выберите режим:",
         reply_markup=keyboards.day1_mode_kb()
     )
@@ -67,8 +69,9 @@ async def show_disc_result(message: types.Message, state: FSMContext):
         image_path = f"img/Комбинированные профили {profile_filename}.png"
 
     try:
-        await message.answer_photo(
-            photo=types.FSInputFile(image_path),
+        await media.answer_photo(
+            message,
+            image_path,
             caption=result_message,
             reply_markup=keyboards.disc_result_kb(share_text)
         )
@@ -77,10 +80,8 @@ async def show_disc_result(message: types.Message, state: FSMContext):
         await message.answer(result_message, reply_markup=keyboards.disc_result_kb(share_text))
 
     uid = message.chat.id
-    await db.add_result(uid, result['title']) # Сохраняем результат
-    if not await db.has_completed_day(uid, 1):
-        await db.update_points(uid, 10)
-        await db.mark_day_completed(uid, 1)
+    # Сохраняем результат и при первом прохождении начисляем баллы одним запросом
+    if await db.complete_day(uid, 1, points=10, result=result['title'], result_once=False):
         await message.answer("🎉 Вам начислено <b>+10 баллов</b> за прохождение теста!")
     
     await state.set_state(TestStates.CHOOSE_TEST)
@@ -92,8 +93,9 @@ async def start_day1_serious(callback: types.CallbackQuery, state: FSMContext):
     await safe_delete_message(callback.message)
     await state.set_state(TestStates.SERIOUS_TEST)
     await state.update_data(disc_q=0, disc_scores={"D": 0, "i": 0, "S": 0, "C": 0})
-    await callback.message.answer_photo(
-        photo=types.FSInputFile("img/DiSC тест.png"),
+    await media.answer_photo(
+        callback.message,
+        "img/DiSC тест.png",
         caption=texts.SERIOUS_INTRO
     )
     await ask_next_disc_question(callback.message, state)
@@ -199,8 +201,9 @@ async def show_fun_result(message: types.Message, state: FSMContext):
     image_path = f"img/joke-test/{image_filename}"
 
     try:
-        await message.answer_photo(
-            photo=types.FSInputFile(image_path),
+        await media.answer_photo(
+            message,
+            image_path,
             caption=result_message,
             reply_markup=keyboards.fun_result_kb(share_text)
         )
@@ -209,10 +212,8 @@ async def show_fun_result(message: types.Message, state: FSMContext):
         await message.answer(result_message, reply_markup=keyboards.fun_result_kb(share_text))
 
     uid = message.chat.id
-    await db.add_result(uid, result['title']) # Сохраняем результат
-    if not await db.has_completed_day(uid, 1):
-        await db.update_points(uid, 10)
-        await db.mark_day_completed(uid, 1)
+    # Сохраняем результат и при первом прохождении начисляем баллы одним запросом
+    if await db.complete_day(uid, 1, points=10, result=result['title'], result_once=False):
         await message.answer("🎉 Вам начислено <b>+10 баллов</b> за прохождение теста!")
         
     await state.set_state(TestStates.CHOOSE_TEST)
@@ -224,8 +225,9 @@ async def start_day1_fun(callback: types.CallbackQuery, state: FSMContext):
     await state.set_state(TestStates.FUN_TEST)
     scores = {archetype: 0 for archetype in texts.ARCHETYPES}
     await state.update_data(fun_q=0, fun_scores=scores)
-    await callback.message.answer_photo(
-        photo=types.FSInputFile("img/joke-test/Шуточный тест.png"),
+    await media.answer_photo(
+        callback.message,
+        "img/joke-test/Шуточный тест.png",
         caption=texts.FUN_TEST_INTRO
     )
     await ask_next_fun_question(callback.message, state)
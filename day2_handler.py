@@ -1,11 +1,13 @@
 import json
 import logging
 from aiogram import Router, types, F
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.fsm.context import FSMContext
 
 import db
 import texts
 import keyboards
+import media
 from states import Day2States
 from utils import safe_delete_message # Импортируем из общего хендлера
 
@@ -18,6 +20,28 @@ def parse_idx(cb_data: str) -> int | None:
     num_str = parts[-1]
     return int(num_str) if num_str.isdigit() else None
     
+async def show_day2_photo(message: types.Message, state: FSMContext, photo_path: str, caption: str, reply_markup, edit_message: bool):
+    """
+    Показывает фото с подписью и кнопками. При редактировании меняет медиа, только если
+    сообщение сейчас показывает другую картинку, иначе обновляет лишь подпись и клавиатуру.
+    """
+    data = await state.get_data()
+    if edit_message and message.photo:
+        if data.get("day2_shown_media") == [message.message_id, photo_path]:
+            try:
+                await message.edit_caption(caption=caption, reply_markup=reply_markup)
+            except TelegramBadRequest as e:
+                if "message is not modified" not in str(e):
+                    raise
+            return
+        await media.edit_photo(message.bot, message.chat.id, message.message_id, photo_path, caption=caption, reply_markup=reply_markup)
+        shown_message_id = message.message_id
+    else:
+        sent = await media.answer_photo(message, photo_path, caption=caption, reply_markup=reply_markup)
+        shown_message_id = sent.message_id
+    # Запоминаем, какая картинка сейчас в сообщении, чтобы не загружать ее повторно
+    await state.update_data(day2_shown_media=[shown_message_id, photo_path])
+
 # ===== ДЕНЬ 2: КАРТОЧКИ =====
 
 async def start_day2(user_id: int, message: types.Message, state: FSMContext, edit_message: bool = False):
@@ -28,8 +52,9 @@ async def start_day2(user_id: int, message: types.Message, state: FSMContext, ed
     if len(opened_cards) >= 5 and not progress.get("final_message_shown", False):
         try:
             # Отправляем финальное сообщение без кнопок
-            await message.answer_photo(
-                photo=types.FSInputFile("img/Мотивационная карточка-5.png"),
+            await media.answer_photo(
+                message,
+                "img/Мотивационная карточка-5.png",
                 caption=texts.DAY2_ALL_CARDS_OPENED
             )
             # Устанавливаем флаг, что сообщение было показано
@@ -39,8 +64,7 @@ async def start_day2(user_id: int, message: types.Message, state: FSMContext, ed
             await message.answer(texts.DAY2_ALL_CARDS_OPENED)
 
         # Отмечаем день пройденным, если еще не отмечен
-        if not await db.has_completed_day(user_id, 2):
-            await db.mark_day_completed(user_id, 2)
+        await db.complete_day(user_id, 2)
     
     # --- Всегда показываем меню Дня 2 ---
     await state.set_state(Day2States.CHOOSE_CARD)
@@ -51,21 +75,15 @@ async def start_day2(user_id: int, message: types.Message, state: FSMContext, ed
     if opened_cards:
         caption_text = f"Продолжим! У тебя осталось {5 - len(opened_cards)} карточек на сегодня.\n\n" + caption_text
 
-    media = types.InputMediaPhoto(
-        media=types.FSInputFile("img/День 2.png"),
-        caption=caption_text
-    )
+    photo_path = "img/День 2.png"
     reply_markup = keyboards.day2_cards_kb(opened_cards)
 
     try:
-        if edit_message:
-            await message.edit_media(media=media, reply_markup=reply_markup)
-        else:
-            await message.answer_photo(photo=media.media, caption=media.caption, reply_markup=reply_markup)
+        await show_day2_photo(message, state, photo_path, caption_text, reply_markup, edit_message)
     except Exception as e:
         logging.error(f"Day 2 - Failed to show menu: {e}")
         try:
-            await message.answer_photo(photo=media.media, caption=media.caption, reply_markup=reply_markup)
+            await show_day2_photo(message, state, photo_path, caption_text, reply_markup, edit_message=False)
         except Exception as e2:
             logging.error(f"Day 2 - Fallback failed: {e2}")
 
@@ -79,20 +97,10 @@ async def handle_day2_card(callback: types.CallbackQuery, state: FSMContext):
 
     uid = callback.from_user.id
 
-    # Получаем текущий прогресс
-    progress = await db.get_day_progress(uid, 2)
-    opened_cards = progress.get("cards_opened", [])
-
-    if card_idx in opened_cards:
+    # Атомарно отмечаем карточку открытой и начисляем баллы; если она уже была открыта, баллы не начисляем
+    if not await db.append_day_progress_item(uid, 2, "cards_opened", card_idx, f"day2:card:{card_idx}", 3):
         await callback.answer("Эта карточка уже была открыта.", show_alert=True)
         return
-
-    # Обновляем список открытых карточек и сохраняем в БД
-    opened_cards.append(card_idx)
-    await db.update_day_progress_data(uid, 2, {"cards_opened": opened_cards})
-    
-    # Начисляем баллы
-    await db.update_points(uid, 3)
     
     card = texts.DAY2_CARDS[card_idx]
     # Объединяем текст карточки и уведомление о баллах
@@ -111,12 +119,13 @@ async def handle_day2_card(callback: types.CallbackQuery, state: FSMContext):
 
     try:
         # Редактируем медиа, заменяя меню на карточку
-        await callback.message.edit_media(
-            media=types.InputMediaPhoto(
-                media=types.FSInputFile(photo_path),
-                caption=card_text
-            ),
-            reply_markup=keyboards.day2_after_card_kb()
+        await show_day2_photo(
+            callback.message,
+            state,
+            photo_path,
+            card_text,
+            keyboards.day2_after_card_kb(),
+            edit_message=True
         )
     except Exception as e:
         logging.error(f"Day 2 - Failed to edit message to show card {card_idx}: {e}")
@@ -1,9 +1,11 @@
 from aiogram import Router, types, F
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.fsm.context import FSMContext
 
 import db
 import texts
 import keyboards
+import media
 from states import Day3States
 from utils import safe_delete_message
 import logging
@@ -15,8 +17,9 @@ async def start_day3(message: types.Message, state: FSMContext):
     await state.clear()
     await state.set_state(Day3States.CHOOSE_HERO)
     await state.update_data(hero_idx=0)
-    await message.answer_photo(
-        photo=types.FSInputFile("img/День 3.png"),
+    await media.answer_photo(
+        message,
+        "img/День 3.png",
         caption=texts.DAY3_INTRO
     )
     await show_hero_card(message, state)
@@ -32,15 +35,23 @@ async def show_hero_card(message: types.Message, state: FSMContext, message_id_t
     caption = f"<b>{hero_info['name']}</b>\n<i>{hero_info['description']}</i>"
     
     if message_id_to_edit:
-        await message.bot.edit_message_media(
-            media=types.InputMediaPhoto(media=types.FSInputFile(hero_info['img']), caption=caption),
-            chat_id=message.chat.id,
-            message_id=message_id_to_edit,
-            reply_markup=keyboards.day3_hero_select_kb(heroes_keys, hero_idx)
-        )
+        try:
+            await media.edit_photo(
+                message.bot,
+                message.chat.id,
+                message_id_to_edit,
+                hero_info['img'],
+                caption=caption,
+                reply_markup=keyboards.day3_hero_select_kb(heroes_keys, hero_idx)
+            )
+        except TelegramBadRequest as e:
+            # Двойное нажатие стрелки: сообщение уже показывает этого героя
+            if "message is not modified" not in str(e):
+                raise
     else:
-        await message.answer_photo(
-            photo=types.FSInputFile(hero_info['img']),
+        await media.answer_photo(
+            message,
+            hero_info['img'],
             caption=caption,
             reply_markup=keyboards.day3_hero_select_kb(heroes_keys, hero_idx)
         )
@@ -82,12 +93,24 @@ async def ask_comics_question(message: types.Message, state: FSMContext):
     options_text = "\n".join([f"{i+1}. {choice[0]}" for i, choice in enumerate(frame_data['choices'])])
     caption = f"{frame_data['text']}\n\n{options_text}\n\n<i>Кадр {frame_idx+1}/{len(comics_frames)}</i>"
 
-    await message.answer_photo(
-        photo=types.FSInputFile(frame_data['img']),
+    await media.answer_photo(
+        message,
+        frame_data['img'],
         caption=caption,
         reply_markup=keyboards.day3_comics_choice_kb(frame_data['choices'])
     )
 
+    # Пока пользователь читает кадр, заранее готовим следующий кадр и все концовки героя.
+    # В память без служебного чата читается только следующий кадр: из концовок понадобится одна
+    next_idx = frame_idx + 1
+    if next_idx < len(comics_frames) and comics_frames[next_idx]['choices']:
+        media.prefetch(message.bot, comics_frames[next_idx]['img'], in_memory=True)
+    for trait in comics_frames[-1].get('endings', {}):
+        media.prefetch(message.bot, comics_ending_image(hero, trait))
+
+def comics_ending_image(hero: str, trait: str) -> str:
+    return f"img/comics/{hero}_ending_{trait}.png"
+
 async def show_comics_result(message: types.Message, state: FSMContext):
     data = await state.get_data()
     hero = data.get("hero")
@@ -117,11 +140,12 @@ async def show_comics_result(message: types.Message, state: FSMContext):
 
     # Получаем текст концовки
     ending_text = texts.DAY3_COMICS[hero][-1]['endings'][dominant_trait]
-    image_path = f"img/comics/{hero}_ending_{dominant_trait}.png"
+    image_path = comics_ending_image(hero, dominant_trait)
 
     try:
-        await message.answer_photo(
-            photo=types.FSInputFile(image_path),
+        await media.answer_photo(
+            message,
+            image_path,
             caption=ending_text,
             reply_markup=keyboards.day3_after_comics_kb()
         )
@@ -129,17 +153,9 @@ async def show_comics_result(message: types.Message, state: FSMContext):
         logging.warning(f"Не удалось отправить фото {image_path}: {e}. Отправляю текстом.")
         await message.answer(ending_text, reply_markup=keyboards.day3_after_comics_kb())
 
-    # Новая логика начисления баллов
-    day3_progress = await db.get_day_progress(uid, 3)
-    completed_heroes = day3_progress.get("completed_heroes", [])
-
-    if hero not in completed_heroes:
-        await db.update_points(uid, 5)  # Баллы за прохождение комикса
+    # Баллы начисляются только за первое прохождение комикса этим героем
+    if await db.append_day_progress_item(uid, 3, "completed_heroes", hero, f"day3:comics:{hero}", 5):
         await message.answer("🎉 Вам начислено <b>+5 баллов</b> за прохождение истории!")
-        
-        # Обновляем прогресс в БД
-        completed_heroes.append(hero)
-        await db.update_day_progress_data(uid, 3, {"completed_heroes": completed_heroes})
 
 @router.callback_query(Day3States.COMICS_PROGRESS, F.data.startswith("day3:comics_choice:"))
 async def handle_comics_choice(callback: types.CallbackQuery, state: FSMContext):
@@ -224,9 +240,7 @@ async def show_quiz_result(message: types.Message, state: FSMContext):
         f"<i>{recommendation}</i>",
     )
 
-    if not await db.has_completed_day(uid, 3):
-        await db.mark_day_completed(uid, 3)
-        await db.add_result(uid, f"Архетип дня 3: {archetype}")
+    if await db.complete_day(uid, 3, result=f"Архетип дня 3: {archetype}"):
         await message.answer("Поздравляем, вы завершили День 3!")
         
 @router.callback_query(Day3States.QUIZ, F.data.startswith("day3:quiz_answer:"))
@@ -289,8 +303,9 @@ async def play_day3_podcast(callback: types.CallbackQuery):
     if podcast_info:
         audio_path = f"audio/{podcast_info['file']}"
         try:
-            await callback.message.answer_audio(
-                audio=types.FSInputFile(audio_path),
+            await media.answer_audio(
+                callback.message,
+                audio_path,
                 caption=podcast_info['caption']
             )
         except Exception as e:
@@ -6,8 +6,9 @@ import random
 import db
 import texts
 import keyboards
+import media
 from states import Day4States
-from utils import safe_delete_message
+from utils import message_ref, safe_delete_ref
 
 
 router = Router()
@@ -35,8 +36,9 @@ async def start_day4(message: types.Message, state: FSMContext):
     await state.set_state(Day4States.WATCHING_VIDEO)
     await state.update_data(case_idx=0, sent_messages=[])
 
-    await message.answer_photo(
-        photo=types.FSInputFile("img/День 4.png"),
+    await media.answer_photo(
+        message,
+        "img/День 4.png",
         caption=texts.DAY4_INTRO
     )
     await send_day4_video(message, state)
@@ -48,10 +50,10 @@ async def send_day4_video(message: types.Message, state: FSMContext):
     
     if case_idx >= len(texts.DAY4_CASES):
         # Все кейсы пройдены
-        await db.mark_day_completed(message.chat.id, 4)
-        await db.add_result(message.chat.id, "Тренер интонации")
-        await message.answer_photo(
-            photo=types.FSInputFile("img/Тренер интонации.png"),
+        await db.complete_day(message.chat.id, 4, result="Тренер интонации")
+        await media.answer_photo(
+            message,
+            "img/Тренер интонации.png",
             caption=random.choice(texts.DAY4_FINAL_MOTIVATION)
         )
         await message.answer(
@@ -64,13 +66,14 @@ async def send_day4_video(message: types.Message, state: FSMContext):
     case = texts.DAY4_CASES[case_idx]
     
     # Отправка видео с кнопкой "Посмотрел"
-    sent_message = await message.answer_video(
-        video=types.FSInputFile(case['video']),
+    sent_message = await media.answer_video(
+        message,
+        case['video'],
         caption=f"<b>{case['title']}</b>",
         reply_markup=watched_video_kb(case_idx)
     )
-    # Сохраняем весь объект сообщения, а не только его ID
-    await state.update_data(sent_messages=data.get('sent_messages', []) + [sent_message])
+    # Сохраняем только ссылку на сообщение: состояние FSM хранится в БД
+    await state.update_data(sent_messages=data.get('sent_messages', []) + [message_ref(sent_message)])
 
 
 @router.callback_query(Day4States.WATCHING_VIDEO, F.data.startswith("day4:watched:"))
@@ -79,8 +82,8 @@ async def handle_watched_video(callback: types.CallbackQuery, state: FSMContext)
     data = await state.get_data()
     
     # Удаляем предыдущие сообщения (включая видео и прошлый фидбэк)
-    for msg in data.get('sent_messages', []):
-        await safe_delete_message(msg)
+    for ref in data.get('sent_messages', []):
+        await safe_delete_ref(callback.bot, ref)
     await state.update_data(sent_messages=[])
 
     await callback.answer("Отлично! Теперь ответьте на вопрос.")
@@ -98,19 +101,19 @@ async def ask_day4_question(message: types.Message, state: FSMContext):
     question_text = f"Что было не так в этой переписке?\n\n{options_text}"
     image_path = f"img/Аудио-викторина-{case_idx + 1}.png"
     
-    sent_message = await message.answer_photo(
-        photo=types.FSInputFile(image_path),
+    sent_message = await media.answer_photo(
+        message,
+        image_path,
         caption=question_text,
         reply_markup=day4_quiz_kb(case['options'], case_idx)
     )
-    # Сохраняем весь объект сообщения
-    await state.update_data(sent_messages=data.get('sent_messages', []) + [sent_message])
+    await state.update_data(sent_messages=data.get('sent_messages', []) + [message_ref(sent_message)])
 
 
 @router.callback_query(Day4States.QUIZ, F.data.startswith("day4:answer:"))
 async def handle_day4_answer(callback: types.CallbackQuery, state: FSMContext):
     """Обрабатывает ответ пользователя на вопрос викторины."""
-    await db.create_user(callback.from_user.id, callback.from_user.username)
+    await db.create_user(callback.from_user.id, callback.from_user.username, callback.from_user.full_name)
     _, _, case_idx_str, answer_idx_str = callback.data.split(":")
     case_idx = int(case_idx_str)
     answer_idx = int(answer_idx_str)
@@ -118,8 +121,8 @@ async def handle_day4_answer(callback: types.CallbackQuery, state: FSMContext):
     data = await state.get_data()
     
     # Удаляем предыдущие сообщения (только сообщение с вопросом)
-    for msg in data.get('sent_messages', []):
-        await safe_delete_message(msg)
+    for ref in data.get('sent_messages', []):
+        await safe_delete_ref(callback.bot, ref)
     await state.update_data(sent_messages=[])
 
     if case_idx != data.get("case_idx"):
@@ -130,22 +133,22 @@ async def handle_day4_answer(callback: types.CallbackQuery, state: FSMContext):
 
     feedback_message = None # Переменная для хранения сообщения с фидбэком
 
-    progress = await db.get_day_progress(callback.from_user.id, 4)
-    answered_cases = progress.get("answered_cases", [])
-
-    if case_idx in answered_cases:
-        feedback_message = await callback.message.answer(f"Вы уже отвечали на этот вопрос.")
-    elif answer_idx == case["correct"]:
-        feedback_message = await callback.message.answer(f"✅ Да, это правильный вариант!\n\n<i>{case['comment']}</i>")
-        await db.update_points(callback.from_user.id, 3)
-        answered_cases.append(case_idx)
-        await db.update_day_progress_data(callback.from_user.id, 4, {"answered_cases": answered_cases})
+    if answer_idx == case["correct"]:
+        # Атомарно отмечаем кейс решенным; баллы начисляются только при первом правильном ответе
+        if await db.append_day_progress_item(callback.from_user.id, 4, "answered_cases", case_idx, f"day4:case:{case_idx}", 3):
+            feedback_message = await callback.message.answer(f"✅ Да, это правильный вариант!\n\n<i>{case['comment']}</i>")
+        else:
+            feedback_message = await callback.message.answer(f"Вы уже отвечали на этот вопрос.")
     else:
-        feedback_message = await callback.message.answer(f"❌ Этот ответ не правильный.\n\n<i>{case['comment']}</i>")
+        progress = await db.get_day_progress(callback.from_user.id, 4)
+        if case_idx in progress.get("answered_cases", []):
+            feedback_message = await callback.message.answer(f"Вы уже отвечали на этот вопрос.")
+        else:
+            feedback_message = await callback.message.answer(f"❌ Этот ответ не правильный.\n\n<i>{case['comment']}</i>")
     
     # ⭐ ИЗМЕНЕНИЕ ЗДЕСЬ: Сохраняем сообщение с фидбэком в состояние, чтобы удалить его на следующем шаге
     if feedback_message:
-        await state.update_data(sent_messages=[feedback_message])
+        await state.update_data(sent_messages=[message_ref(feedback_message)])
         
     await state.update_data(case_idx=case_idx + 1)
     await state.set_state(Day4States.WATCHING_VIDEO)
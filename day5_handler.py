@@ -6,8 +6,9 @@ from aiogram.fsm.storage.base import StorageKey
 import db
 import texts
 import keyboards
+import media
 from states import Day5States
-from utils import safe_delete_message
+from utils import safe_delete_message, message_ref, safe_delete_ref
 
 router = Router()
 
@@ -18,8 +19,9 @@ async def start_day5(message: types.Message, state: FSMContext):
     await state.clear()
     await state.set_state(Day5States.QUIZ)
     await state.update_data(q_idx=0, correct_answers=0, user_id=user_id)
-    await message.answer_photo(
-        photo=types.FSInputFile("img/День 5.png"),
+    await media.answer_photo(
+        message,
+        "img/День 5.png",
         caption=texts.DAY5_INTRO
     )
     await ask_day5_question(message, state)
@@ -27,8 +29,8 @@ async def start_day5(message: types.Message, state: FSMContext):
 async def ask_day5_question(message: types.Message, state: FSMContext):
     data = await state.get_data()
     # Удаляем предыдущие сообщения (если есть)
-    for msg in data.get('sent_messages', []):
-        await safe_delete_message(msg)
+    for ref in data.get('sent_messages', []):
+        await safe_delete_ref(message.bot, ref)
     await state.update_data(sent_messages=[])
 
     q_idx = data.get("q_idx", 0)
@@ -41,23 +43,28 @@ async def ask_day5_question(message: types.Message, state: FSMContext):
     options_text = "\n".join([f"{i+1}. {option}" for i, option in enumerate(question['options'])])
     caption = f"<b>Вопрос {q_idx+1}/{len(texts.DAY5_QUIZ_QUESTIONS)}</b>\n{question['text']}\n\n{options_text}"
     image_path = f"img/final-quiz-day/фин квиз-{q_idx + 1}.png"
-    sent_message = await message.answer_photo(
-        photo=types.FSInputFile(image_path),
+    sent_message = await media.answer_photo(
+        message,
+        image_path,
         caption=caption,
         reply_markup=keyboards.day5_quiz_kb(question['options'])
     )
-    await state.update_data(sent_messages=[sent_message])
+    await state.update_data(sent_messages=[message_ref(sent_message)])
 
 async def show_day5_quiz_results(message: types.Message, state: FSMContext):
     data = await state.get_data()
     user_id = data.get("user_id")
     correct_answers = data.get("correct_answers", 0)
 
-    # Проверяем, проходил ли пользователь квиз раньше
+    # Проверяем, проходил ли пользователь квиз раньше; баллы за квиз начисляются один раз на ключ
     progress = await db.get_day_progress(user_id, 5)
+    awarded = False
     if not progress.get("quiz_completed", False):
-        await db.update_points(user_id, 20) # Баллы за квиз
+        # Флаг ставится независимо от начисления: если баллы уже были в журнале
+        # (например, после сбоя между двумя записями), квиз все равно считается пройденным
+        awarded = await db.award_points(user_id, "day5:quiz", 20)
         await db.update_day_progress_data(user_id, 5, {"quiz_completed": True})
+    if awarded:
         await message.answer(
             f"Квиз завершен!\nПравильных ответов: {correct_answers} из {len(texts.DAY5_QUIZ_QUESTIONS)}.\n"
             f"Вам начислено <b>+20 баллов!</b>",
@@ -93,8 +100,9 @@ async def handle_day5_answer(callback: types.CallbackQuery, state: FSMContext):
     else:
         keyboard = keyboards.day5_next_question_kb()
 
-    await callback.message.answer_photo(
-        photo=types.FSInputFile(image_path),
+    await media.answer_photo(
+        callback.message,
+        image_path,
         caption=feedback_text,
         reply_markup=keyboard
     )
@@ -121,16 +129,16 @@ async def start_reflection(callback: types.CallbackQuery, state: FSMContext):
 
 @router.message(Day5States.REFLECTION)
 async def handle_reflection(message: types.Message, state: FSMContext):
-    # Проверяем, проходил ли пользователь рефлексию раньше
-    progress = await db.get_day_progress(message.from_user.id, 5)
-    if not progress.get("reflection_completed", False):
-        await db.save_reflection(message.from_user.id, message.text)
-        await db.update_points(message.from_user.id, 15)
-        await db.mark_day_completed(message.from_user.id, 5)
-        await db.update_day_progress_data(message.from_user.id, 5, {"reflection_completed": True})
-        final_motivation = random.choice(texts.DAY5_FINAL_MOTIVATION_CARD_TEXTS)
-        await db.add_result(message.from_user.id, final_motivation)
-        
+    # Рефлексия, баллы, завершение дня и результат сохраняются одним запросом и только в первый раз
+    final_motivation = random.choice(texts.DAY5_FINAL_MOTIVATION_CARD_TEXTS)
+    completed_now = await db.complete_day(
+        message.from_user.id, 5,
+        points=15,
+        result=final_motivation,
+        reflection=message.text,
+        progress={"reflection_completed": True},
+    )
+    if completed_now:
         full_caption = (
             "Спасибо за твой отзыв! Марафон завершен. Тебе начислено <b>+15 баллов.</b>\n\n"
             "Загляни в свой профиль, чтобы увидеть все результаты и награды!"
@@ -139,8 +147,9 @@ async def handle_reflection(message: types.Message, state: FSMContext):
         # Отправка финальной фотокарточки
         image_path = f"img/{final_motivation}.png"
         
-        await message.answer_photo(
-            photo=types.FSInputFile(image_path),
+        await media.answer_photo(
+            message,
+            image_path,
             caption=full_caption
         )
         await state.clear()
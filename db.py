@@ -1,240 +1,342 @@
-import asyncpg
-import json
-from config import DB_HOST, DB_PORT, DB_USER, DB_PASS, DB_NAME, EVENT_DAYS
+"""
+Слой данных бота. Сами запросы выполняет хранилище из пакета storage (PostgreSQL, SQLite
+или память, см. DB_BACKEND в config.py), а здесь находятся общие для всех хранилищ кэши,
+уведомления об изменениях и журнал записей.
+"""
+import asyncio
+from collections import OrderedDict
+from config import DB_BACKEND, EVENT_DAYS, KNOWN_USERS_CACHE_SIZE, DAYS_LISTEN_RETRY_MIN, DAYS_LISTEN_RETRY_MAX
+from storage import Storage, create_storage
+import leaderboard
 
-POOL = None
+STORAGE: Storage | None = None
 
-async def get_pool():
-    """Создает и возвращает пул соединений к базе данных."""
-    global POOL
-    if POOL is None:
-        print("LOG: Создание пула соединений с PostgreSQL...")
-        try:
-            POOL = await asyncpg.create_pool(
-                user=DB_USER,
-                password=DB_PASS,
-                database=DB_NAME,
-                host=DB_HOST,
-                port=DB_PORT
-            )
-            print("LOG: Пул соединений успешно создан.")
-        except Exception as e:
-            print(f"FATAL: Не удалось подключиться к PostgreSQL: {e}")
-            raise
-    return POOL
+async def get_storage() -> Storage:
+    """Создает и возвращает хранилище, выбранное в настройках."""
+    global STORAGE
+    if STORAGE is None:
+        storage = create_storage(DB_BACKEND)
+        await storage.connect()
+        STORAGE = storage
+    return STORAGE
+
+async def close_storage():
+    global STORAGE
+    storage, STORAGE = STORAGE, None
+    if storage is not None:
+        await storage.close()
 
 async def init_db():
-    """Инициализирует таблицы в базе данных."""
-    print("LOG: Инициализация базы данных PostgreSQL...")
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        await conn.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id BIGINT PRIMARY KEY,
-                username TEXT,
-                points INTEGER DEFAULT 0,
-                rewards JSONB DEFAULT '[]'::jsonb,
-                results JSONB DEFAULT '[]'::jsonb,
-                reflection TEXT
-            )
-        ''')
-        
-        await conn.execute('''
-            CREATE TABLE IF NOT EXISTS daily_progress (
-                user_id BIGINT,
-                day_number INTEGER,
-                completed INTEGER DEFAULT 0,
-                data JSONB DEFAULT '{}'::jsonb,
-                PRIMARY KEY (user_id, day_number),
-                FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
-            )
-        ''')
-
-        await conn.execute('''
-            CREATE TABLE IF NOT EXISTS bot_state (
-                key TEXT PRIMARY KEY,
-                value TEXT
-            )
-        ''')
-
-        await conn.execute('''
-            CREATE TABLE IF NOT EXISTS days (
-                day_number INTEGER PRIMARY KEY,
-                is_open BOOLEAN DEFAULT FALSE
-            )
-        ''')
-    print("LOG: Инициализация БД PostgreSQL завершена.")
+    """Подключается к хранилищу и применяет недостающие миграции схемы."""
+    print(f"LOG: Инициализация базы данных ({DB_BACKEND})...")
+    await get_storage()
+    print("LOG: Инициализация БД завершена.")
 
 async def init_days():
-    """Заполняет таблицу дней, если она пуста."""
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        count = await conn.fetchval('SELECT COUNT(*) FROM days')
-        if count == 0:
-            print("LOG: Таблица 'days' пуста. Инициализация дней...")
-            for i in range(1, EVENT_DAYS + 1):
-                is_open = (i == 1)
-                await conn.execute(
-                    'INSERT INTO days (day_number, is_open) VALUES ($1, $2)',
-                    i, is_open
-                )
-            print(f"LOG: Таблица 'days' инициализирована. День 1 открыт.")
+    """Добавляет недостающие дни; первый день создается открытым."""
+    storage = await get_storage()
+    if await storage.init_days(EVENT_DAYS):
+        print(f"LOG: Таблица 'days' инициализирована. День 1 открыт.")
+
+# --- Кэш состояния дней ---
+# Открытые дни и текущий день меняются только командами администратора, поэтому хранятся
+# в памяти. Изменения рассылаются через NOTIFY, и все запущенные копии бота сбрасывают кэш.
+# Для PostgreSQL кэш используется только пока слушающее соединение живо, иначе значения
+# читаются из БД, а подписка восстанавливается в фоне. SQLite и память обслуживают один процесс, им достаточно локального сброса.
+DAYS_CHANNEL = "days_changed"
+_MISSING = object()
+_days_cache = {"open_days": _MISSING, "current_day": _MISSING}
+# Увеличивается при каждом сбросе, чтобы не сохранить в кэш значение, прочитанное до изменения
+_days_version = 0
+_days_cache_enabled = False
+_resubscribe_task: asyncio.Task | None = None
+
+def _invalidate_days_cache(key=None):
+    global _days_version
+    _days_version += 1
+    for cache_key in ([key] if key in _days_cache else _days_cache):
+        _days_cache[cache_key] = _MISSING
+
+def _store_days_cache(key, value, version):
+    if _days_cache_enabled and version == _days_version:
+        _days_cache[key] = value
+
+def _on_listener_lost():
+    global _days_cache_enabled, _resubscribe_task
+    _days_cache_enabled = False
+    _invalidate_days_cache()
+    print("LOG: Соединение LISTEN закрыто, кэш дней отключен до переподключения.")
+    if _resubscribe_task is None or _resubscribe_task.done():
+        _resubscribe_task = asyncio.get_running_loop().create_task(_resubscribe())
+
+async def _resubscribe():
+    """Повторяет подписку с удваивающейся паузой, пока она не восстановится."""
+    delay = DAYS_LISTEN_RETRY_MIN
+    while not _days_cache_enabled:
+        await asyncio.sleep(delay)
+        try:
+            await listen_days_changes()
+        except Exception as e:
+            delay = min(delay * 2, DAYS_LISTEN_RETRY_MAX)
+            print(f"LOG: Не удалось восстановить подписку на изменения дней: {e}. Повтор через {delay} с.")
+
+async def listen_days_changes():
+    """Подписывается на изменения дней от всех копий бота и включает кэш."""
+    global _days_cache_enabled
+    if _days_cache_enabled:
+        return
+    storage = await get_storage()
+    if await storage.subscribe(DAYS_CHANNEL, _invalidate_days_cache, _on_listener_lost):
+        print("LOG: Подписка на изменения дней включена.")
+    _invalidate_days_cache()
+    _days_cache_enabled = True
+
+async def stop_listening_days_changes():
+    global _days_cache_enabled, _resubscribe_task
+    _days_cache_enabled = False
+    if _resubscribe_task is not None:
+        _resubscribe_task.cancel()
+        _resubscribe_task = None
+    if STORAGE is not None:
+        await STORAGE.unsubscribe()
+    _invalidate_days_cache()
+
+async def _notify_days_changed(key):
+    _invalidate_days_cache(key)
+    storage = await get_storage()
+    await storage.notify(DAYS_CHANNEL, key)
 
 # --- Управление днями ---
 async def open_next_day():
     """Открывает следующий закрытый день."""
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        next_day_to_open = await conn.fetchval(
-            'SELECT day_number FROM days WHERE is_open = FALSE ORDER BY day_number LIMIT 1'
-        )
-        if next_day_to_open:
-            await conn.execute(
-                'UPDATE days SET is_open = TRUE WHERE day_number = $1',
-                next_day_to_open
-            )
-            print(f"LOG WRITE: День {next_day_to_open} был открыт.")
-            return next_day_to_open
-        return None
+    storage = await get_storage()
+    next_day_to_open = await storage.open_next_day()
+    if next_day_to_open:
+        await _notify_days_changed("open_days")
+        print(f"LOG WRITE: День {next_day_to_open} был открыт.")
+    return next_day_to_open
 
 async def close_last_day():
     """Закрывает последний открытый день, кроме первого."""
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        last_day_to_close = await conn.fetchval(
-            'SELECT day_number FROM days WHERE is_open = TRUE ORDER BY day_number DESC LIMIT 1'
-        )
-        if last_day_to_close and last_day_to_close > 1:
-            await conn.execute(
-                'UPDATE days SET is_open = FALSE WHERE day_number = $1',
-                last_day_to_close
-            )
-            print(f"LOG WRITE: День {last_day_to_close} был закрыт.")
-            return last_day_to_close
-        return None
+    storage = await get_storage()
+    last_day_to_close = await storage.close_last_day()
+    if last_day_to_close:
+        await _notify_days_changed("open_days")
+        print(f"LOG WRITE: День {last_day_to_close} был закрыт.")
+    return last_day_to_close
 
 async def get_open_days():
     """Возвращает список номеров открытых дней."""
-    pool = await get_pool()
-    records = await pool.fetch('SELECT day_number FROM days WHERE is_open = TRUE ORDER BY day_number')
-    return [record['day_number'] for record in records]
+    open_days = _days_cache["open_days"]
+    if open_days is _MISSING:
+        version = _days_version
+        storage = await get_storage()
+        open_days = tuple(await storage.get_open_days())
+        _store_days_cache("open_days", open_days, version)
+    return list(open_days)
 
 # --- Состояние бота ---
 async def set_bot_state(key, value):
-    pool = await get_pool()
-    await pool.execute('INSERT INTO bot_state (key, value) VALUES ($1, $2) ON CONFLICT (key) DO UPDATE SET value = $2', key, str(value))
+    storage = await get_storage()
+    await storage.set_bot_state(key, str(value))
 
 async def get_bot_state(key):
-    pool = await get_pool()
-    value = await pool.fetchval('SELECT value FROM bot_state WHERE key = $1', key)
-    return value
+    storage = await get_storage()
+    return await storage.get_bot_state(key)
 
 async def get_current_day():
-    day = await get_bot_state('current_day')
-    return int(day) if day else None
+    day = _days_cache["current_day"]
+    if day is _MISSING:
+        version = _days_version
+        value = await get_bot_state('current_day')
+        day = int(value) if value else None
+        _store_days_cache("current_day", day, version)
+    return day
 
 async def set_current_day(day: int):
     await set_bot_state('current_day', day)
+    await _notify_days_changed("current_day")
     print(f"LOG WRITE: Текущий день изменен на {day}")
 
+# --- Кэш file_id медиафайлов ---
+async def get_media_file_id(path, content_hash):
+    storage = await get_storage()
+    return await storage.get_media_file_id(path, content_hash)
+
+async def get_all_media_file_ids():
+    """Возвращает все сохраненные file_id в виде словаря (path, content_hash) -> file_id."""
+    storage = await get_storage()
+    return await storage.get_all_media_file_ids()
+
+async def save_media_file_id(path, content_hash, file_id):
+    storage = await get_storage()
+    await storage.save_media_file_id(path, content_hash, file_id)
+
+async def delete_media_file_id(path, content_hash):
+    storage = await get_storage()
+    await storage.delete_media_file_id(path, content_hash)
+
+async def delete_media_file_ids(paths):
+    storage = await get_storage()
+    await storage.delete_media_file_ids(paths)
+
+# --- Состояния FSM ---
+async def get_fsm_record(key):
+    storage = await get_storage()
+    return await storage.get_fsm_record(key)
+
+async def get_fsm_records():
+    storage = await get_storage()
+    return await storage.get_fsm_records()
+
+async def save_fsm_records(records):
+    """Сохраняет записи (key, state, data) одной операцией; запись без state и data удаляется."""
+    storage = await get_storage()
+    await storage.save_fsm_records(records)
+
+async def expire_fsm_records(ttl):
+    """Удаляет состояния FSM пользователей, которые ничего не делали дольше ttl секунд."""
+    storage = await get_storage()
+    expired = await storage.expire_fsm_records(ttl)
+    if expired:
+        print(f"LOG WRITE: Удалено брошенных сессий FSM: {expired}.")
+    return expired
+
 # --- Пользователи ---
-async def create_user(user_id, username):
-    pool = await get_pool()
-    result = await pool.execute('INSERT INTO users (id, username) VALUES ($1, $2) ON CONFLICT (id) DO NOTHING', user_id, username)
-    if result == 'INSERT 0 1':
+# Пользователи, которые точно есть в БД: id -> username. create_user вызывается почти в каждом
+# обработчике, а новые пользователи появляются редко, поэтому для известных запрос не нужен.
+_known_users: OrderedDict[int, str | None] = OrderedDict()
+user_cache_stats = {"hit": 0, "miss": 0}
+
+def _remember_user(user_id, username):
+    _known_users[user_id] = username
+    _known_users.move_to_end(user_id)
+    while len(_known_users) > KNOWN_USERS_CACHE_SIZE:
+        _known_users.popitem(last=False)
+
+def forget_user(user_id):
+    _known_users.pop(user_id, None)
+
+async def create_user(user_id, username, full_name=None):
+    """Создает пользователя, если его нет, и обновляет username, только если он изменился."""
+    if user_id in _known_users and _known_users[user_id] == username:
+        _known_users.move_to_end(user_id)
+        user_cache_stats["hit"] += 1
+        return
+    user_cache_stats["miss"] += 1
+    storage = await get_storage()
+    change = await storage.upsert_user(user_id, username, full_name)
+    _remember_user(user_id, username)
+    if change is not None:
+        leaderboard.add_user(user_id, username, full_name)
+    if change == "created":
         print(f"LOG WRITE: Создан пользователь с ID={user_id}, username='{username}'")
+    elif change == "updated":
+        print(f"LOG WRITE: У пользователя ID={user_id} обновлен username на '{username}'")
+
+# --- Баллы ---
+# Все начисления проходят через журнал points_ledger с ключом начисления (например, day2:card:3).
+# Повторное начисление с тем же ключом ничего не меняет, поэтому двойное нажатие не дает баллы дважды.
+async def award_points(user_id, award_key, points):
+    """Начисляет баллы один раз на ключ. Возвращает True, если баллы были начислены."""
+    storage = await get_storage()
+    awarded = await storage.award_points(user_id, award_key, points)
+    if awarded:
+        leaderboard.add_points(user_id, points)
+        print(f"LOG WRITE: Пользователю ID={user_id} добавлено {points} очков ({award_key}).")
+    return awarded
 
-async def update_points(user_id, points_to_add):
-    pool = await get_pool()
-    await pool.execute('UPDATE users SET points = points + $1 WHERE id = $2', points_to_add, user_id)
-    print(f"LOG WRITE: Пользователю ID={user_id} добавлено {points_to_add} очков.")
+async def get_leaderboard():
+    """Все пользователи с баллами по убыванию баллов, для построения рейтинга."""
+    storage = await get_storage()
+    return await storage.get_leaderboard()
+
+async def recompute_points():
+    """Пересчитывает балансы всех пользователей по журналу начислений."""
+    storage = await get_storage()
+    fixed = await storage.recompute_points()
+    await leaderboard.reload()
+    print(f"LOG WRITE: Балансы пересчитаны по журналу, исправлено: {fixed}.")
+    return fixed
 
 async def get_profile(user_id):
-    pool = await get_pool()
-    user_row = await pool.fetchrow('SELECT * FROM users WHERE id = $1', user_id)
-    return dict(user_row) if user_row else None
+    storage = await get_storage()
+    return await storage.get_profile(user_id)
+
+async def get_profile_snapshot(user_id):
+    """
+    Возвращает профиль пользователя вместе с количеством пройденных дней и прогрессом
+    по всем дням (словарь номер_дня -> data) одним обращением к хранилищу.
+    """
+    storage = await get_storage()
+    return await storage.get_profile_snapshot(user_id)
+
+async def save_full_name(user_id, full_name):
+    storage = await get_storage()
+    await storage.save_full_name(user_id, full_name)
+
+async def get_certificate_candidates(min_points):
+    """Пользователи, выполнившие условия получения сертификата (квиз и рефлексия Дня 5, баллы)."""
+    storage = await get_storage()
+    return await storage.get_certificate_candidates(min_points)
 
 async def add_result(user_id, result_text):
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        async with conn.transaction():
-            results_val = await conn.fetchval('SELECT results FROM users WHERE id = $1', user_id)
-            
-            if results_val is None:
-                results = []
-            elif isinstance(results_val, str):
-                results = json.loads(results_val)
-            else:
-                results = results_val
-
-            if result_text not in results:
-                results.append(result_text)
-                await conn.execute('UPDATE users SET results = $1 WHERE id = $2', json.dumps(results), user_id)
-                print(f"LOG WRITE: Пользователю ID={user_id} добавлен результат '{result_text}'.")
-
-async def save_reflection(user_id, reflection_text):
-    """Сохраняет текст рефлексии пользователя."""
-    pool = await get_pool()
-    await pool.execute(
-        'UPDATE users SET reflection = $1 WHERE id = $2',
-        reflection_text, user_id
-    )
-    print(f"LOG WRITE: Для пользователя ID={user_id} сохранена рефлексия.")
+    """
+    Дописывает результат в users.results без дубликатов, поэтому повторный вызов
+    (например, двойное нажатие) ничего не меняет. Возвращает True, если результат был добавлен.
+    """
+    storage = await get_storage()
+    added = await storage.add_result(user_id, result_text)
+    if added:
+        print(f"LOG WRITE: Пользователю ID={user_id} добавлен результат '{result_text}'.")
+    return added
 
-# --- Прогресс по дням ---
-async def mark_day_completed(user_id, day_number):
-    pool = await get_pool()
-    await pool.execute(
-        'INSERT INTO daily_progress (user_id, day_number, completed) VALUES ($1, $2, 1) '
-        'ON CONFLICT (user_id, day_number) DO UPDATE SET completed = 1',
-        user_id, day_number
-    )
-    print(f"LOG WRITE: Для пользователя ID={user_id} день {day_number} отмечен как пройденный.")
-
-async def has_completed_day(user_id, day_number):
-    pool = await get_pool()
-    result = await pool.fetchval('SELECT completed FROM daily_progress WHERE user_id = $1 AND day_number = $2', user_id, day_number)
-    return result == 1
+async def export_users_csv(path):
+    """Выгружает пользователей, баллы, результаты, прохождение дней и рефлексии в CSV."""
+    storage = await get_storage()
+    return await storage.export_users_csv(path, EVENT_DAYS)
 
+# --- Прогресс по дням ---
 async def get_day_progress(user_id, day_number):
-    pool = await get_pool()
-    data = await pool.fetchval('SELECT data FROM daily_progress WHERE user_id = $1 AND day_number = $2', user_id, day_number)
-    if isinstance(data, str):
-        return json.loads(data)
-    return data if data else {}
+    storage = await get_storage()
+    return await storage.get_day_progress(user_id, day_number)
 
 async def update_day_progress_data(user_id, day_number, new_data_dict):
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        async with conn.transaction():
-            current_data_str = await conn.fetchval('SELECT data FROM daily_progress WHERE user_id = $1 AND day_number = $2', user_id, day_number)
-            
-            if isinstance(current_data_str, str):
-                current_data = json.loads(current_data_str)
-            else:
-                current_data = current_data_str if current_data_str else {}
-
-            current_data.update(new_data_dict)
-            
-            await conn.execute(
-                'INSERT INTO daily_progress (user_id, day_number, data) VALUES ($1, $2, $3) '
-                'ON CONFLICT (user_id, day_number) DO UPDATE SET data = $3',
-                user_id, day_number, json.dumps(current_data)
-            )
-
-async def has_completed_all_days(user_id):
-    pool = await get_pool()
-    completed_days = await pool.fetchval('SELECT COUNT(*) FROM daily_progress WHERE user_id = $1 AND completed = 1', user_id)
-    return (completed_days or 0) >= EVENT_DAYS
+    """Дописывает поля в data прогресса дня, не затирая остальные."""
+    storage = await get_storage()
+    await storage.update_day_progress_data(user_id, day_number, new_data_dict)
+
+async def append_day_progress_item(user_id, day_number, key, item, award_key=None, points=0):
+    """
+    Атомарно добавляет элемент в список data[key] прогресса дня, если его там еще нет, и в той же
+    операции начисляет points по ключу award_key, поэтому прогресс не сохранится без баллов.
+    Возвращает True, если элемент был добавлен, и False, если он уже был в списке.
+    """
+    storage = await get_storage()
+    appended = await storage.append_day_progress_item(user_id, day_number, key, item, award_key, points)
+    if appended and award_key is not None:
+        leaderboard.add_points(user_id, points)
+        print(f"LOG WRITE: Пользователю ID={user_id} добавлено {points} очков ({award_key}).")
+    return appended
+
+async def complete_day(user_id, day_number, points=0, result=None, reflection=None, progress=None, result_once=True):
+    """
+    Завершает день одной атомарной операцией: отмечает день пройденным и, только если
+    он не был пройден раньше, начисляет баллы, сохраняет рефлексию и дописывает поля progress.
+    Результат дописывается без дубликатов; при result_once=False — и при повторном прохождении.
+    Возвращает True, если день был завершен этим вызовом.
+    """
+    storage = await get_storage()
+    completed_now = await storage.complete_day(user_id, day_number, points, result, reflection, progress, result_once)
+    if completed_now:
+        leaderboard.add_points(user_id, points)
+        print(f"LOG WRITE: Для пользователя ID={user_id} день {day_number} отмечен как пройденный, начислено {points} очков.")
+    return completed_now
 
 async def reset_user_progress(user_id):
     """Сбрасывает прогресс пользователя."""
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        async with conn.transaction():
-            await conn.execute(
-                "UPDATE users SET points = 0, rewards = '[]'::jsonb, results = '[]'::jsonb, reflection = NULL WHERE id = $1",
-                user_id
-            )
-            await conn.execute('DELETE FROM daily_progress WHERE user_id = $1', user_id)
+    storage = await get_storage()
+    await storage.reset_user_progress(user_id)
+    forget_user(user_id)
+    leaderboard.set_points(user_id, 0)
     print(f"LOG WRITE: Прогресс для пользователя ID={user_id} был полностью сброшен.")
@@ -0,0 +1,275 @@
+"""
+Хранилище состояний FSM aiogram в БД бота.
+
+Состояния переживают перезапуск и общие для всех копий бота. Данные состояния хранятся
+компактно: JSON без пробелов, а при размере от FSM_COMPRESS_MIN_SIZE байт — сжатый zlib.
+
+Обработчики несколько раз за обновление вызывают get_data, update_data и set_state, поэтому
+в обработчик передается UpdateFSMContext: запись читается из БД один раз за обновление,
+дальше чтения идут из памяти, а после обработки изменения сохраняются одним запросом
+(см. FSMUpdateMiddleware).
+
+Сессии без изменений дольше FSM_SESSION_TTL удаляются (watch_idle_sessions), поэтому таблица
+состояний не растет от пользователей, которые начали тест или комикс и ушли.
+"""
+import asyncio
+import copy
+import json
+import logging
+import sys
+import zlib
+from typing import Any, Awaitable, Callable, Dict, Mapping
+
+from aiogram import Bot
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.middleware import FSMContextMiddleware
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import (
+    BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey, DEFAULT_DESTINY,
+)
+from aiogram.types import TelegramObject
+
+import db
+from config import FSM_COMPRESS_MIN_SIZE, FSM_DATA_BUDGET, FSM_SESSION_TTL, FSM_EXPIRE_INTERVAL
+from states import validate_data
+
+# Первый байт записи — формат данных
+_FORMAT_JSON = b"j"
+_FORMAT_ZLIB = b"z"
+_MISSING = object()
+
+
+def encode_data(data: Mapping[str, Any]) -> bytes | None:
+    if not data:
+        return None
+    raw = json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode()
+    if len(raw) >= FSM_COMPRESS_MIN_SIZE:
+        packed = zlib.compress(raw)
+        if len(packed) < len(raw):
+            return _FORMAT_ZLIB + packed
+    return _FORMAT_JSON + raw
+
+
+def decode_data(blob: bytes | None) -> Dict[str, Any]:
+    if not blob:
+        return {}
+    blob = bytes(blob)
+    body = blob[1:]
+    if blob[:1] == _FORMAT_ZLIB:
+        body = zlib.decompress(body)
+    return json.loads(body)
+
+
+def _state_name(state: StateType) -> str | None:
+    return state.state if isinstance(state, State) else state
+
+
+class DBStorage(BaseStorage):
+    """
+    Хранилище FSM поверх db.py. Каждый вызов — запрос к БД; внутри обработчиков используется
+    UpdateFSMContext, который обращается к хранилищу не чаще одного чтения и одной записи
+    за обновление.
+    """
+
+    def __init__(self, key_builder: KeyBuilder | None = None):
+        self.key_builder = key_builder or DefaultKeyBuilder(prefix="fsm")
+        # Суммарно по всем обновлениям: обращения обработчиков к состоянию и запросы к БД
+        self.stats = {"updates": 0, "calls": 0, "reads": 0, "writes": 0, "over_budget": 0}
+
+    async def read_record(self, key: StorageKey) -> tuple[str | None, Dict[str, Any]]:
+        row = await db.get_fsm_record(self.key_builder.build(key))
+        state, blob = row or (None, None)
+        return state, decode_data(blob)
+
+    async def write_record(self, key: StorageKey, state: str | None, data: Mapping[str, Any]):
+        blob = encode_data(data)
+        if blob and len(blob) > FSM_DATA_BUDGET:
+            self.stats["over_budget"] += 1
+            logging.warning(f"Данные состояния {key.user_id} занимают {len(blob)} байт при бюджете {FSM_DATA_BUDGET}")
+        await db.save_fsm_records([(self.key_builder.build(key), state, blob)])
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        _, data = await self.read_record(key)
+        await self.write_record(key, _state_name(state), data)
+
+    async def get_state(self, key: StorageKey) -> str | None:
+        state, _ = await self.read_record(key)
+        return state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        validate_data(data)
+        state, _ = await self.read_record(key)
+        await self.write_record(key, state, data)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, data = await self.read_record(key)
+        return data
+
+    async def close(self) -> None:
+        pass
+
+
+class UpdateFSMContext(FSMContext):
+    """
+    Состояние пользователя в пределах одного обновления. Запоминает измененные поля и
+    сохраняет запись в flush, только если что-то действительно изменилось.
+    """
+    storage: DBStorage
+
+    def __init__(self, storage: DBStorage, key: StorageKey):
+        super().__init__(storage, key)
+        self._loaded = False
+        self._state: str | None = None
+        self._data: Dict[str, Any] = {}
+        self._state_changed = False
+        self.dirty_fields: set[str] = set()
+        # Обращения обработчика к состоянию и запросы к БД за это обновление
+        self.ops = {"calls": 0, "reads": 0, "writes": 0}
+
+    async def _load(self):
+        self.ops["calls"] += 1
+        if not self._loaded:
+            self._state, self._data = await self.storage.read_record(self.key)
+            self.ops["reads"] += 1
+            self._loaded = True
+
+    async def set_state(self, state: StateType = None) -> None:
+        await self._load()
+        state = _state_name(state)
+        if state != self._state:
+            self._state = state
+            self._state_changed = True
+
+    async def get_state(self) -> str | None:
+        await self._load()
+        return self._state
+
+    async def set_data(self, data: Mapping[str, Any]) -> None:
+        validate_data(data)
+        await self._load()
+        data = copy.deepcopy(dict(data))
+        self.dirty_fields.update(
+            field for field in data.keys() | self._data.keys()
+            if data.get(field, _MISSING) != self._data.get(field, _MISSING)
+        )
+        self._data = data
+
+    async def get_data(self) -> Dict[str, Any]:
+        await self._load()
+        return copy.deepcopy(self._data)
+
+    async def get_value(self, key: str, default: Any | None = None) -> Any | None:
+        await self._load()
+        return copy.deepcopy(self._data.get(key, default))
+
+    async def update_data(self, data: Mapping[str, Any] | None = None, **kwargs: Any) -> Dict[str, Any]:
+        if data:
+            kwargs.update(data)
+        validate_data(kwargs)
+        await self._load()
+        for field, value in kwargs.items():
+            if self._data.get(field, _MISSING) != value:
+                self._data[field] = copy.deepcopy(value)
+                self.dirty_fields.add(field)
+        return copy.deepcopy(self._data)
+
+    async def flush(self):
+        """Сохраняет состояние одним запросом, если за обновление оно изменилось."""
+        if not (self._state_changed or self.dirty_fields):
+            return
+        await self.storage.write_record(self.key, self._state, self._data)
+        self.ops["writes"] += 1
+        self._state_changed = False
+        self.dirty_fields.clear()
+
+
+class FSMUpdateMiddleware(FSMContextMiddleware):
+    """
+    FSMContextMiddleware, который передает в обработчик UpdateFSMContext и сохраняет
+    состояние после обработки обновления, даже если обработчик упал.
+    Подключается вместо встроенного: Dispatcher(..., disable_fsm=True).
+    """
+    storage: DBStorage
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        async def handle_and_flush(event: TelegramObject, data: Dict[str, Any]) -> Any:
+            state: UpdateFSMContext | None = data.get("state")
+            if state is None:
+                return await handler(event, data)
+            try:
+                return await handler(event, data)
+            finally:
+                dirty_fields = sorted(state.dirty_fields)
+                await state.flush()
+                stats = self.storage.stats
+                stats["updates"] += 1
+                for op, count in state.ops.items():
+                    stats[op] += count
+                logging.debug(f"FSM {state.key.user_id}: {state.ops}, измененные поля: {dirty_fields}")
+
+        return await super().__call__(handle_and_flush, event, data)
+
+    def get_context(
+        self,
+        bot: Bot,
+        chat_id: int,
+        user_id: int,
+        thread_id: int | None = None,
+        business_connection_id: str | None = None,
+        destiny: str = DEFAULT_DESTINY,
+    ) -> UpdateFSMContext:
+        return UpdateFSMContext(
+            storage=self.storage,
+            key=StorageKey(
+                user_id=user_id,
+                chat_id=chat_id,
+                bot_id=bot.id,
+                thread_id=thread_id,
+                business_connection_id=business_connection_id,
+                destiny=destiny,
+            ),
+        )
+
+
+def _deep_sizeof(value: Any) -> int:
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(_deep_sizeof(k) + _deep_sizeof(v) for k, v in value.items())
+    elif isinstance(value, (list, tuple)):
+        size += sum(_deep_sizeof(item) for item in value)
+    return size
+
+
+async def memory_report() -> dict:
+    """
+    Размер данных активных сессий: в памяти процесса (словарь Python, как их держала
+    MemoryStorage) и в БД после кодирования.
+    """
+    records = await db.get_fsm_records()
+    stored = [len(data) if data else 0 for _, _, data in records]
+    in_memory = [_deep_sizeof(decode_data(data)) for _, _, data in records]
+    sessions = len(records)
+    return {
+        "sessions": sessions,
+        "memory_total": sum(in_memory),
+        "memory_avg": sum(in_memory) // sessions if sessions else 0,
+        "stored_total": sum(stored),
+        "stored_avg": sum(stored) // sessions if sessions else 0,
+        "stored_max": max(stored, default=0),
+        "over_budget": sum(size > FSM_DATA_BUDGET for size in stored),
+    }
+
+
+async def watch_idle_sessions():
+    """Фоновая задача: периодически удаляет сессии без изменений дольше FSM_SESSION_TTL."""
+    while True:
+        await asyncio.sleep(FSM_EXPIRE_INTERVAL)
+        try:
+            await db.expire_fsm_records(FSM_SESSION_TTL)
+        except Exception as e:
+            logging.warning(f"Не удалось удалить брошенные сессии FSM: {e}")
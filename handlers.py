@@ -1,17 +1,25 @@
+import html
 import logging
-import uuid
 import os
-import random
+import tempfile
+import time
+import uuid
+from datetime import datetime
 from aiogram import Router, types, F
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
-from aiogram.types import InlineQuery, InlineQueryResultArticle, InputTextMessageContent
-import json
+from aiogram.types import FSInputFile, InlineQuery, InlineQueryResultArticle, InputTextMessageContent
 
-from config import EVENT_DAYS
+from config import EVENT_DAYS, LEADERBOARD_TOP_SIZE, FSM_DATA_BUDGET, FSM_SESSION_TTL
 import db
+import certificate
+import leaderboard
 import keyboards
+import media
+import memes
+import user_queue
 from commands import USER_COMMANDS_TEXT, ADMIN_COMMANDS_TEXT
+from fsm_storage import DBStorage, memory_report
 from utils import is_admin, to_main_menu, safe_delete_message
 
 from day1_handler import start_day1
@@ -28,9 +36,9 @@ import texts
 
 @router.message(Command("start"))
 async def cmd_start(message: types.Message, state: FSMContext):
-    await db.create_user(message.from_user.id, message.from_user.username)
+    await db.create_user(message.from_user.id, message.from_user.username, message.from_user.full_name)
     await state.clear()
-    await message.answer_photo(photo=types.FSInputFile("img/Старт.png"))
+    await media.answer_photo(message, "img/Старт.png")
     await message.answer(
         text=texts.START_TEXT,
         reply_markup=keyboards.main_menu_kb(),
@@ -42,72 +50,82 @@ async def btn_help(message: types.Message):
 
 @router.message(F.text == "Генератор мемов")
 async def btn_meme_generator(message: types.Message):
-    meme_folder = "img/mem"
-    memes = [f for f in os.listdir(meme_folder) if os.path.isfile(os.path.join(meme_folder, f))]
-    if not memes:
+    meme = memes.next_meme(message.from_user.id)
+    if not meme:
         await message.answer("Извините, мемы временно недоступны.")
         return
-    
-    random_meme = random.choice(memes)
-    meme_path = os.path.join(meme_folder, random_meme)
-    
-    await message.answer_photo(
-        photo=types.FSInputFile(meme_path),
+
+    meme_path, digest = meme
+    await media.answer_photo(
+        message,
+        meme_path,
+        digest=digest,
         caption="Смех — лучший коммуникатор"
     )
 
 @router.message(F.text == "Профиль")
 async def btn_profile(message: types.Message):
-    profile = await db.get_profile(message.from_user.id)
+    profile = await db.get_profile_snapshot(message.from_user.id)
     if not profile:
         await message.answer("Профиль не найден. Нажмите /start, чтобы начать.", reply_markup=keyboards.main_menu_kb())
         return
 
-    rewards_val = profile.get('rewards')
-    rewards_list = json.loads(rewards_val) if isinstance(rewards_val, str) and rewards_val else (rewards_val if isinstance(rewards_val, list) else [])
+    rewards_list = profile['rewards']
+    results_list = profile['results']
 
-    results_val = profile.get('results')
-    results_list = json.loads(results_val) if isinstance(results_val, str) and results_val else (results_val if isinstance(results_val, list) else [])
-
-    if await db.has_completed_all_days(message.from_user.id) and "Мастер коммуникаций" not in rewards_list:
+    if profile['completed_days'] >= EVENT_DAYS and "Мастер коммуникаций" not in rewards_list:
         rewards_list.append("Мастер коммуникаций")
     
     results_text = "\n" + "\n".join([f"• {item}" for item in results_list]) if results_list else " 0"
 
+    user_rank = leaderboard.rank(profile['id'])
+    rank_text = f"Место в рейтинге: {user_rank[0]} из {user_rank[1]}\n" if user_rank else ""
+
     caption = (
         f"<b>Профиль:</b>\n"
         f"ID: <code>{profile['id']}</code>\n"
         f"Логин: {profile['username'] or '—'}\n"
-        f"Баллы: {profile['points']}\n\n"
+        f"Баллы: {profile['points']}\n"
+        f"{rank_text}\n"
         f"<b>Результаты:</b>{results_text}"
     )
 
-    show_rewards_buttons = False
-    day5_progress = await db.get_day_progress(message.from_user.id, 5)
-    if day5_progress:
-        quiz_done = day5_progress.get("quiz_completed", False)
-        reflection_done = day5_progress.get("reflection_completed", False)
-        if quiz_done and reflection_done and profile.get('points', 0) >= 60:
-            show_rewards_buttons = True
+    show_rewards_buttons = certificate.is_eligible(profile, profile['progress'].get(5))
 
-    await message.answer_photo(
-        photo=types.FSInputFile("img/13.png"),
+    await media.answer_photo(
+        message,
+        "img/13.png",
         caption=caption,
         reply_markup=keyboards.profile_kb(show_rewards=show_rewards_buttons)
     )
 
+@router.callback_query(F.data == "leaderboard")
+async def show_leaderboard(callback: types.CallbackQuery):
+    rows = leaderboard.top(LEADERBOARD_TOP_SIZE)
+    if not rows:
+        await callback.answer("Рейтинг пока пуст.", show_alert=True)
+        return
+    lines = [f"{place}. {html.escape(name)} — {points}" for place, name, points in rows]
+    user_rank = leaderboard.rank(callback.from_user.id)
+    if user_rank:
+        lines.append(f"\nВаше место: {user_rank[0]} из {user_rank[1]}")
+    await callback.message.answer("<b>🏆 Рейтинг участников</b>\n\n" + "\n".join(lines))
+    await callback.answer()
+
 @router.callback_query(F.data == "get_certificate")
 async def get_certificate_handler(callback: types.CallbackQuery):
     user_id = callback.from_user.id
-    profile = await db.get_profile(user_id)
-    day5_progress = await db.get_day_progress(user_id, 5)
-    quiz_done = day5_progress.get("quiz_completed", False)
-    reflection_done = day5_progress.get("reflection_completed", False)
+    profile = await db.get_profile_snapshot(user_id)
 
-    if quiz_done and reflection_done and profile.get('points', 0) >= 60:
+    if profile and certificate.is_eligible(profile, profile['progress'].get(5)):
         try:
-            await callback.message.answer_photo(
-                photo=types.FSInputFile("img/certificate/Сертификат_Мастер коммникаций.png"),
+            full_name = callback.from_user.full_name
+            if full_name and profile.get('full_name') != full_name:
+                await db.save_full_name(user_id, full_name)
+                profile['full_name'] = full_name
+            await media.answer_photo(
+                callback.message,
+                await certificate.get_certificate(profile),
                 caption="Поздравляем! Вот ваш сертификат."
             )
             await db.add_result(user_id, "Сертификат и стикеры")
@@ -124,8 +142,9 @@ async def send_podcast(callback: types.CallbackQuery):
     day = int(callback.data.split(":")[1])
     audio_path = f"audio/case{day}.mp3"
     try:
-        await callback.message.answer_audio(
-            audio=types.FSInputFile(audio_path),
+        await media.answer_audio(
+            callback.message,
+            audio_path,
             caption=f"Подкаст день {day}"
         )
         await callback.answer()
@@ -144,7 +163,7 @@ async def btn_select_day(message: types.Message):
 async def cb_select_day(callback: types.CallbackQuery, state: FSMContext):
     day = int(callback.data.split(":")[1])
     uid = callback.from_user.id
-    await db.create_user(uid, callback.from_user.username)
+    await db.create_user(uid, callback.from_user.username, callback.from_user.full_name)
 
     # --- Специальная обработка для Дня 2 ---
     if day == 2:
@@ -239,6 +258,107 @@ async def cmd_set_day(message: types.Message):
     else:
         await message.answer(f"⚠️ День должен быть в диапазоне 1-{EVENT_DAYS}.")
 
+@router.message(Command("mediastats"))
+async def cmd_media_stats(message: types.Message):
+    if not is_admin(message.from_user.id): return
+    stats = media.prefetch_stats
+    total = stats["hit"] + stats["miss"]
+    hit_rate = f"{stats['hit'] / total:.0%}" if total else "—"
+
+    uploads = media.upload_stats
+    deduplicated = sum(s["deduplicated"] for s in uploads.values())
+    saved_mb = sum(s["bytes_saved"] for s in uploads.values()) / 1024 / 1024
+    top = sorted(uploads.items(), key=lambda item: item[1]["deduplicated"], reverse=True)[:5]
+    top_text = "\n".join(f"• {path}: {s['deduplicated']}" for path, s in top if s["deduplicated"])
+
+    await message.answer(
+        f"<b>Упреждающая загрузка:</b>\n"
+        f"Успела: {stats['hit']}\n"
+        f"Не успела: {stats['miss']}\n"
+        f"Доля попаданий: {hit_rate}\n\n"
+        f"<b>Загрузки файлов:</b>\n"
+        f"Выполнено: {sum(s['uploads'] for s in uploads.values())}\n"
+        f"Объединено с параллельными: {deduplicated} ({saved_mb:.1f} МБ)"
+        + (f"\n{top_text}" if top_text else "")
+    )
+
+@router.message(Command("dbstats"))
+async def cmd_db_stats(message: types.Message, fsm_storage: DBStorage):
+    if not is_admin(message.from_user.id): return
+    stats = db.user_cache_stats
+    total = stats["hit"] + stats["miss"]
+    hit_rate = f"{stats['hit'] / total:.0%}" if total else "—"
+    fsm = fsm_storage.stats
+    fsm_queries = fsm["reads"] + fsm["writes"]
+    per_update = f"{fsm_queries / fsm['updates']:.2f}" if fsm["updates"] else "—"
+    await message.answer(
+        f"<b>Кэш пользователей:</b>\n"
+        f"В памяти: {len(db._known_users)}\n"
+        f"Без запроса к БД: {stats['hit']}\n"
+        f"С запросом к БД: {stats['miss']}\n"
+        f"Доля попаданий: {hit_rate}\n\n"
+        f"<b>Состояния FSM:</b>\n"
+        f"Обновлений: {fsm['updates']}\n"
+        f"Обращений обработчиков: {fsm['calls']}\n"
+        f"Запросов к БД: {fsm_queries} (чтений {fsm['reads']}, записей {fsm['writes']})\n"
+        f"Запросов на обновление: {per_update}"
+    )
+
+@router.message(Command("fsmstats"))
+async def cmd_fsm_stats(message: types.Message):
+    if not is_admin(message.from_user.id): return
+    report = await memory_report()
+    await message.answer(
+        f"<b>Состояния FSM:</b>\n"
+        f"Сессий: {report['sessions']} (без изменений дольше {FSM_SESSION_TTL // 3600} ч. удаляются)\n"
+        f"В памяти процесса (как в MemoryStorage): {report['memory_total']} байт, "
+        f"в среднем {report['memory_avg']} на сессию\n"
+        f"В БД: {report['stored_total']} байт, в среднем {report['stored_avg']}, "
+        f"максимум {report['stored_max']} на сессию\n"
+        f"Бюджет на пользователя: {FSM_DATA_BUDGET} байт, превышений: {report['over_budget']}"
+    )
+
+@router.message(Command("queues"))
+async def cmd_queues(message: types.Message):
+    if not is_admin(message.from_user.id): return
+    users, pending = user_queue.active_queues()
+    lines = [f"<b>Очереди обновлений:</b>", f"Пользователей в обработке: {users}, обновлений: {pending}"]
+    for update_type, stats in sorted(user_queue.queue_stats.items()):
+        avg_wait = stats["wait_total"] / stats["waited"] * 1000 if stats["waited"] else 0
+        lines.append(
+            f"\n<b>{update_type}</b>: {stats['updates']} обновлений, ждали очереди {stats['waited']}\n"
+            f"Ожидание: в среднем {avg_wait:.0f} мс, максимум {stats['wait_max'] * 1000:.0f} мс\n"
+            f"Максимальная длина очереди: {stats['depth_max']}"
+        )
+    await message.answer("\n".join(lines))
+
+@router.message(Command("recalcpoints"))
+async def cmd_recalc_points(message: types.Message):
+    if not is_admin(message.from_user.id): return
+    fixed = await db.recompute_points()
+    await message.answer(f"✅ Баллы пересчитаны по журналу начислений. Исправлено балансов: {fixed}.")
+
+@router.message(Command("export"))
+async def cmd_export(message: types.Message):
+    if not is_admin(message.from_user.id): return
+    status = await message.answer("⏳ Готовлю выгрузку...")
+    started = time.perf_counter()
+    fd, path = tempfile.mkstemp(suffix=".csv")
+    os.close(fd)
+    try:
+        rows = await db.export_users_csv(path)
+        elapsed = time.perf_counter() - started
+        await message.answer_document(
+            FSInputFile(path, filename=f"export_{datetime.now():%Y-%m-%d_%H-%M}.csv"),
+            caption=f"Пользователей: {rows}\nВремя выгрузки: {elapsed:.1f} с"
+        )
+    except Exception as e:
+        logging.error(f"Export failed: {e}")
+        await message.answer("Не удалось сформировать выгрузку. Подробности в логах.")
+    finally:
+        os.remove(path)
+        await safe_delete_message(status)
+
 @router.message(Command("def"))
 async def cmd_reset_progress(message: types.Message):
     if not is_admin(message.from_user.id): return
@@ -1,3 +1,4 @@
+from functools import lru_cache
 from aiogram import types
 from config import EVENT_DAYS
 import texts
@@ -11,6 +12,11 @@ def main_menu_kb() -> types.ReplyKeyboardMarkup:
     return types.ReplyKeyboardMarkup(keyboard=buttons, resize_keyboard=True)
 
 def days_menu_kb(open_days: list[int]) -> types.InlineKeyboardMarkup:
+    # Набор открытых дней меняется редко, поэтому разметка строится один раз на каждый набор
+    return _days_menu_kb(tuple(sorted(open_days)))
+
+@lru_cache(maxsize=EVENT_DAYS + 1)
+def _days_menu_kb(open_days: tuple[int, ...]) -> types.InlineKeyboardMarkup:
     buttons = []
     for i in range(1, EVENT_DAYS + 1):
         if i in open_days:
@@ -28,7 +34,7 @@ def back_to_menu_inline() -> types.InlineKeyboardMarkup:
     ])
 
 def profile_kb(show_rewards: bool = False) -> types.InlineKeyboardMarkup:
-    buttons = []
+    buttons = [[types.InlineKeyboardButton(text="🏆 Рейтинг участников", callback_data="leaderboard")]]
     if show_rewards:
         buttons.append([types.InlineKeyboardButton(text="Получить сертификат", callback_data="get_certificate")])
         buttons.append([types.InlineKeyboardButton(text="Получить стикеры", url="https://t.me/addstickers/NedelyaZnanij2025")])
@@ -0,0 +1,90 @@
+"""
+Рейтинг участников по баллам.
+
+Рейтинг хранится в памяти как отсортированный список пар (-баллы, user_id), поэтому место
+пользователя находится двоичным поиском без запросов к БД. Список загружается из БД при
+старте, обновляется при каждом начислении баллов через db.py и периодически сверяется с БД,
+чтобы подхватить начисления других копий бота и пересчеты балансов.
+"""
+import asyncio
+import logging
+from bisect import bisect_left, insort
+
+from config import LEADERBOARD_RECONCILE_INTERVAL
+
+# Отсортированный по убыванию баллов список (-points, user_id)
+_ranking: list[tuple[int, int]] = []
+# user_id -> текущие баллы в рейтинге
+_points: dict[int, int] = {}
+# user_id -> имя для отображения в топе
+_names: dict[int, str] = {}
+_loaded = False
+
+
+def _display_name(user: dict) -> str:
+    return user.get("full_name") or (f"@{user['username']}" if user.get("username") else f"ID {user['id']}")
+
+
+def set_points(user_id: int, points: int):
+    """Ставит пользователю новое значение баллов, сохраняя порядок списка."""
+    old = _points.get(user_id)
+    if old == points:
+        return
+    if old is not None:
+        idx = bisect_left(_ranking, (-old, user_id))
+        if idx < len(_ranking) and _ranking[idx] == (-old, user_id):
+            del _ranking[idx]
+    _points[user_id] = points
+    insort(_ranking, (-points, user_id))
+
+
+def add_points(user_id: int, points: int):
+    if _loaded:
+        set_points(user_id, _points.get(user_id, 0) + points)
+
+
+def add_user(user_id: int, username: str | None, full_name: str | None):
+    if _loaded:
+        _names[user_id] = _display_name({"id": user_id, "username": username, "full_name": full_name})
+        if user_id not in _points:
+            set_points(user_id, 0)
+
+
+def rank(user_id: int) -> tuple[int, int] | None:
+    """Возвращает (место, всего участников). Участники с равными баллами делят место."""
+    points = _points.get(user_id)
+    if points is None:
+        return None
+    # Кортеж из одного элемента меньше любой пары с теми же баллами, поэтому это число тех, у кого баллов больше
+    return bisect_left(_ranking, (-points,)) + 1, len(_ranking)
+
+
+def top(limit: int) -> list[tuple[int, str, int]]:
+    """Первые limit участников: (место, имя, баллы)."""
+    result = []
+    for negative_points, user_id in _ranking[:limit]:
+        result.append((bisect_left(_ranking, (negative_points,)) + 1, _names.get(user_id, f"ID {user_id}"), -negative_points))
+    return result
+
+
+async def reload():
+    """Перестраивает рейтинг по данным из БД."""
+    global _ranking, _points, _names, _loaded
+    import db
+    users = await db.get_leaderboard()
+    # Строки уже отсортированы по убыванию баллов, остается только упорядочить равные по id
+    _ranking = sorted((-user["points"], user["id"]) for user in users)
+    _points = {user["id"]: user["points"] for user in users}
+    _names = {user["id"]: _display_name(user) for user in users}
+    _loaded = True
+    print(f"LOG: Рейтинг загружен: {len(_ranking)} участников.")
+
+
+async def watch():
+    """Фоновая задача: периодически сверяет рейтинг с БД."""
+    while True:
+        await asyncio.sleep(LEADERBOARD_RECONCILE_INTERVAL)
+        try:
+            await reload()
+        except Exception as e:
+            logging.warning(f"Не удалось обновить рейтинг: {e}")
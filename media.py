@@ -0,0 +1,364 @@
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from collections import OrderedDict, defaultdict
+from aiogram import Bot, types
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+
+import db
+from build_assets import load_manifest, is_video
+from config import MEDIA_PREWARM_CHAT_ID, MEDIA_PREWARM_CONCURRENCY, MEDIA_PREWARM_TIMEOUT
+
+# Каталоги с медиафайлами и тип отправки для каждого расширения
+ASSET_DIRS = ("img", "audio", "video")
+ASSET_KINDS = {".png": "photo", ".jpg": "photo", ".jpeg": "photo", ".mp3": "audio", ".mp4": "video"}
+
+# Кэш хэшей содержимого: path -> ((mtime_ns, size), sha256)
+_hash_cache: dict[str, tuple[tuple[int, int], str]] = {}
+# Локальная копия таблицы media_cache: (path, content_hash) -> file_id
+_file_ids: dict[tuple[str, str], str] = {}
+# Загрузки, которые выполняются прямо сейчас: (path, content_hash) -> future с file_id
+_inflight: dict[tuple[str, str], asyncio.Future] = {}
+# Статистика по каждому файлу: сколько раз он загружался и сколько параллельных загрузок удалось избежать
+upload_stats: defaultdict[str, dict[str, int]] = defaultdict(lambda: {"uploads": 0, "deduplicated": 0, "bytes_saved": 0})
+# Исходный файл -> запись манифеста сборки build/assets (см. build_assets.py)
+_optimized: dict[str, dict] | None = None
+
+
+def _load_optimized() -> dict[str, dict]:
+    """Читает манифест сборки и оставляет только актуальные записи (для фото — еще и действительно меньшие)."""
+    optimized = {}
+    for path, entry in load_manifest().items():
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        if (
+            entry.get("mtime_ns") == stat.st_mtime_ns
+            and entry.get("bytes_in") == stat.st_size
+            and (is_video(path) or entry.get("bytes_out", stat.st_size) < stat.st_size)
+            and os.path.exists(entry.get("output", ""))
+        ):
+            optimized[path] = entry
+    if optimized:
+        print(f"LOG: Загружен манифест собранных медиафайлов: {len(optimized)} файлов.")
+    return optimized
+
+
+def _manifest_entry(path: str) -> dict | None:
+    global _optimized
+    if _optimized is None:
+        _optimized = _load_optimized()
+    return _optimized.get(path)
+
+
+def resolve(path: str) -> str:
+    """Возвращает путь к собранному варианту файла, если он есть."""
+    entry = _manifest_entry(path)
+    return entry["output"] if entry else path
+
+
+def video_meta(path: str) -> dict:
+    """Размеры, длительность и превью видео из манифеста сборки для отправки с поддержкой стриминга."""
+    entry = _manifest_entry(path)
+    if not entry or "duration" not in entry:
+        return {}
+    meta = {"width": entry["width"], "height": entry["height"], "duration": entry["duration"], "supports_streaming": True}
+    if os.path.exists(entry.get("thumbnail", "")):
+        meta["thumbnail"] = entry["thumbnail"]
+    return meta
+
+
+def _file_hash(path: str) -> str:
+    """Считает sha256 содержимого файла."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+async def content_hash(path: str) -> str:
+    """Возвращает хэш содержимого файла, пересчитывая его только при изменении файла."""
+    stat = await asyncio.to_thread(os.stat, path)
+    signature = (stat.st_mtime_ns, stat.st_size)
+    cached = _hash_cache.get(path)
+    if cached and cached[0] == signature:
+        return cached[1]
+    digest = await asyncio.to_thread(_file_hash, path)
+    _hash_cache[path] = (signature, digest)
+    return digest
+
+
+async def get_file_id(path: str, digest: str) -> str | None:
+    """Ищет file_id сначала в памяти процесса, затем в БД."""
+    key = (path, digest)
+    file_id = _file_ids.get(key)
+    if file_id is None:
+        file_id = await db.get_media_file_id(path, digest)
+        if file_id:
+            _file_ids[key] = file_id
+    return file_id
+
+
+async def remember_file_id(path: str, digest: str, file_id: str):
+    _file_ids[(path, digest)] = file_id
+    await db.save_media_file_id(path, digest, file_id)
+
+
+async def forget_file_id(path: str, digest: str):
+    _file_ids.pop((path, digest), None)
+    await db.delete_media_file_id(path, digest)
+
+
+async def forget_files(paths: list[str]):
+    """Забывает file_id и хэши удаленных с диска файлов."""
+    if not paths:
+        return
+    removed = set(paths)
+    for key in [key for key in _file_ids if key[0] in removed]:
+        del _file_ids[key]
+    for path in removed:
+        _hash_cache.pop(path, None)
+    await db.delete_media_file_ids(paths)
+
+
+# Ошибки Telegram, при которых сохраненный file_id больше не годится и файл нужно загрузить заново.
+# Остальные ошибки (например, "message is not modified") к file_id отношения не имеют.
+_FILE_ID_ERRORS = ("wrong file identifier", "wrong remote file identifier", "file_reference_")
+
+
+def _is_file_id_error(error: TelegramBadRequest) -> bool:
+    message = str(error.message).lower()
+    return any(marker in message for marker in _FILE_ID_ERRORS)
+
+
+def extract_file_id(message, kind: str) -> str | None:
+    """Достает file_id загруженного файла из ответа Telegram."""
+    if not isinstance(message, types.Message):
+        return None
+    if kind == "photo":
+        return message.photo[-1].file_id if message.photo else None
+    media = getattr(message, kind, None)
+    return media.file_id if media else None
+
+
+async def _send(path: str, kind: str, send, use_prefetched: bool = True, digest: str | None = None):
+    """
+    Отправляет файл по сохраненному file_id, а если его нет или Telegram его отклонил —
+    загружает файл с диска и запоминает новый file_id.
+    `send` принимает file_id или InputFile и выполняет запрос к Telegram.
+    `digest` — заранее посчитанный content_hash собранного файла; с ним файл на диске не проверяется.
+    """
+    path = resolve(path)
+    prepared = await _take_prefetched(path) if use_prefetched else None
+    if digest is None:
+        digest = await content_hash(path)
+    file_id = await get_file_id(path, digest)
+    if file_id:
+        try:
+            return await send(file_id)
+        except TelegramBadRequest as e:
+            if not _is_file_id_error(e):
+                raise
+            logging.warning(f"file_id для {path} отклонен Telegram ({e}), загружаю файл заново.")
+            await forget_file_id(path, digest)
+
+    # Если этот же файл уже загружается для другого пользователя, ждем ту загрузку и берем ее file_id.
+    # Если Telegram отклонил и его, проверяем снова: загрузку мог уже начать другой ожидающий
+    key = (path, digest)
+    rejected = None
+    while key in _inflight:
+        file_id = await asyncio.shield(_inflight[key])
+        if not file_id or file_id == rejected:
+            continue
+        try:
+            sent = await send(file_id)
+        except TelegramBadRequest as e:
+            if not _is_file_id_error(e):
+                raise
+            logging.warning(f"file_id для {path} отклонен Telegram ({e}), загружаю файл заново.")
+            rejected = file_id
+            continue
+        stats = upload_stats[path]
+        stats["deduplicated"] += 1
+        stats["bytes_saved"] += _hash_cache[path][0][1] if path in _hash_cache else 0
+        return sent
+
+    future = asyncio.get_running_loop().create_future()
+    _inflight[key] = future
+    new_file_id = None
+    try:
+        sent = await send(prepared or types.FSInputFile(path))
+        upload_stats[path]["uploads"] += 1
+        new_file_id = extract_file_id(sent, kind)
+        if new_file_id:
+            await remember_file_id(path, digest, new_file_id)
+        return sent
+    finally:
+        if _inflight.get(key) is future:
+            del _inflight[key]
+        future.set_result(new_file_id)
+
+
+# --- Отправка медиа ---
+async def answer_photo(message: types.Message, path: str, digest: str | None = None, **kwargs) -> types.Message:
+    return await _send(path, "photo", lambda photo: message.answer_photo(photo=photo, **kwargs), digest=digest)
+
+def _video_kwargs(path: str, video) -> dict:
+    """Параметры видео из манифеста. Превью нужно только при загрузке файла, по file_id Telegram его игнорирует."""
+    meta = video_meta(path)
+    thumbnail = meta.pop("thumbnail", None)
+    if thumbnail and not isinstance(video, str):
+        meta["thumbnail"] = types.FSInputFile(thumbnail)
+    return meta
+
+async def answer_video(message: types.Message, path: str, **kwargs) -> types.Message:
+    return await _send(path, "video", lambda video: message.answer_video(video=video, **{**_video_kwargs(path, video), **kwargs}))
+
+async def answer_audio(message: types.Message, path: str, **kwargs) -> types.Message:
+    return await _send(path, "audio", lambda audio: message.answer_audio(audio=audio, **kwargs))
+
+async def edit_photo(bot: Bot, chat_id: int, message_id: int, path: str, caption: str = None, reply_markup=None):
+    """Заменяет фото в уже отправленном сообщении (edit_media) с повторным использованием file_id."""
+    return await _send(path, "photo", lambda photo: bot.edit_message_media(
+        media=types.InputMediaPhoto(media=photo, caption=caption),
+        chat_id=chat_id,
+        message_id=message_id,
+        reply_markup=reply_markup,
+    ))
+
+
+# --- Прогрев кэша при старте ---
+def collect_assets() -> list[tuple[str, str]]:
+    """Обходит каталоги с медиафайлами и возвращает пары (путь, тип отправки)."""
+    assets = []
+    for root_dir in ASSET_DIRS:
+        for root, _, files in os.walk(root_dir):
+            for name in sorted(files):
+                kind = ASSET_KINDS.get(os.path.splitext(name)[1].lower())
+                if kind:
+                    assets.append((os.path.join(root, name), kind))
+    return assets
+
+
+def _send_to_chat(bot: Bot, chat_id: int, path: str, kind: str):
+    senders = {
+        "photo": lambda f: bot.send_photo(chat_id=chat_id, photo=f, disable_notification=True),
+        "video": lambda f: bot.send_video(chat_id=chat_id, video=f, disable_notification=True, **_video_kwargs(path, f)),
+        "audio": lambda f: bot.send_audio(chat_id=chat_id, audio=f, disable_notification=True),
+    }
+    return senders[kind]
+
+
+async def _upload_to_chat(bot: Bot, chat_id: int, path: str, kind: str):
+    """Загружает файл в служебный чат, запоминает file_id и удаляет служебное сообщение."""
+    send = _send_to_chat(bot, chat_id, path, kind)
+    while True:
+        try:
+            sent = await _send(path, kind, send, use_prefetched=False)
+            break
+        except TelegramRetryAfter as e:
+            await asyncio.sleep(e.retry_after)
+    try:
+        await sent.delete()
+    except Exception as e:
+        logging.debug(f"Не удалось удалить служебное сообщение: {e}")
+
+
+async def prewarm(bot: Bot, chat_id: int, concurrency: int = MEDIA_PREWARM_CONCURRENCY, timeout: int = MEDIA_PREWARM_TIMEOUT):
+    """
+    Загружает в служебный чат все медиафайлы, для текущего содержимого которых еще нет file_id.
+    Файлы, не изменившиеся с прошлого запуска, пропускаются. Прогрев ограничен по времени,
+    чтобы не задерживать запуск polling.
+    """
+    started = time.monotonic()
+    _file_ids.update(await db.get_all_media_file_ids())
+    assets = await asyncio.to_thread(collect_assets)
+    semaphore = asyncio.Semaphore(concurrency)
+    stats = {"uploaded": 0, "skipped": 0, "failed": 0}
+
+    async def warm(path: str, kind: str):
+        async with semaphore:
+            try:
+                digest = await content_hash(resolve(path))
+                if (resolve(path), digest) in _file_ids:
+                    stats["skipped"] += 1
+                else:
+                    await _upload_to_chat(bot, chat_id, path, kind)
+                    stats["uploaded"] += 1
+            except Exception as e:
+                stats["failed"] += 1
+                logging.warning(f"Прогрев: не удалось загрузить {path}: {e}")
+            done = sum(stats.values())
+            if done % 10 == 0 or done == len(assets):
+                print(f"LOG: Прогрев медиа {done}/{len(assets)} (загружено {stats['uploaded']}, без изменений {stats['skipped']}, ошибок {stats['failed']})")
+
+    print(f"LOG: Прогрев медиа: найдено {len(assets)} файлов.")
+    try:
+        await asyncio.wait_for(asyncio.gather(*(warm(path, kind) for path, kind in assets)), timeout)
+    except asyncio.TimeoutError:
+        logging.warning(f"Прогрев медиа прерван по таймауту {timeout} с, оставшиеся файлы загрузятся при первой отправке.")
+    print(f"LOG: Прогрев медиа завершен за {time.monotonic() - started:.1f} с: {stats}")
+
+
+# --- Упреждающая подготовка следующих файлов ---
+# Сколько подготовленных заранее файлов держать одновременно
+PREFETCH_LIMIT = 64
+
+# Путь -> задача подготовки; результат — None (file_id уже в кэше) или файл, прочитанный в память
+_prefetched: OrderedDict[str, asyncio.Task] = OrderedDict()
+# hit — подготовка закончилась до того, как файл понадобился; miss — пришлось ее дожидаться
+prefetch_stats = {"hit": 0, "miss": 0}
+
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+async def _prepare(bot: Bot, path: str, kind: str) -> types.BufferedInputFile | None:
+    resolved = resolve(path)
+    digest = await content_hash(resolved)
+    if await get_file_id(resolved, digest):
+        return None
+    if MEDIA_PREWARM_CHAT_ID:
+        await _upload_to_chat(bot, MEDIA_PREWARM_CHAT_ID, path, kind)
+        return None
+    data = await asyncio.to_thread(_read_file, resolved)
+    return types.BufferedInputFile(data, filename=os.path.basename(resolved))
+
+
+def prefetch(bot: Bot, path: str, kind: str = "photo", in_memory: bool = False):
+    """
+    Запускает в фоне подготовку файла, который скорее всего понадобится следующим:
+    загрузку в служебный чат ради file_id. Если чат не настроен, файл читается в память,
+    только когда in_memory=True — для файла, который точно понадобится следующим, а не
+    для одного из возможных вариантов: иначе в памяти копились бы целые картинки,
+    которые никто не отправит.
+    """
+    if not MEDIA_PREWARM_CHAT_ID and not in_memory:
+        return
+    resolved = resolve(path)
+    cached = _hash_cache.get(resolved)
+    if resolved in _prefetched or (cached and (resolved, cached[1]) in _file_ids):
+        return
+    _prefetched[resolved] = asyncio.create_task(_prepare(bot, path, kind))
+    while len(_prefetched) > PREFETCH_LIMIT:
+        _, task = _prefetched.popitem(last=False)
+        task.cancel()
+
+
+async def _take_prefetched(path: str) -> types.BufferedInputFile | None:
+    """Забирает результат подготовки файла, если она запускалась."""
+    task = _prefetched.pop(path, None)
+    if task is None:
+        return None
+    prefetch_stats["hit" if task.done() else "miss"] += 1
+    try:
+        return await task
+    except Exception as e:
+        logging.warning(f"Не удалось заранее подготовить {path}: {e}")
+        return None
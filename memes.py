@@ -0,0 +1,78 @@
+import asyncio
+import logging
+import os
+import random
+
+import media
+
+MEME_FOLDER = "img/mem"
+# Как часто (в секундах) проверять, не изменилось ли содержимое папки с мемами
+REFRESH_INTERVAL = 60
+
+# Отсортированный список (путь, хэш содержимого) мемов; позиция в списке — номер бита в состоянии
+# пользователя. Хэш считается при построении индекса, чтобы отправка не обращалась к диску
+_index: tuple[tuple[str, str], ...] = ()
+_folder_mtime: int | None = None
+# user_id -> битовая маска уже показанных в текущем круге мемов
+_seen: dict[int, int] = {}
+
+
+def _scan_folder() -> tuple[int | None, tuple[str, ...]]:
+    try:
+        mtime = os.stat(MEME_FOLDER).st_mtime_ns
+        entries = sorted(entry.path for entry in os.scandir(MEME_FOLDER) if entry.is_file())
+    except FileNotFoundError:
+        return None, ()
+    return mtime, tuple(entries)
+
+
+async def build_index():
+    """Перечитывает папку с мемами. Номера мемов меняются, поэтому круги пользователей начинаются заново."""
+    global _index, _folder_mtime
+    folder_mtime, paths = await asyncio.to_thread(_scan_folder)
+    index = []
+    for path in paths:
+        try:
+            index.append((path, await media.content_hash(media.resolve(path))))
+        except FileNotFoundError:
+            continue
+    _folder_mtime, _index = folder_mtime, tuple(index)
+    _seen.clear()
+    print(f"LOG: Индекс мемов построен: {len(_index)} файлов.")
+
+
+async def watch_index():
+    """Фоновая задача: перестраивает индекс, когда в папке добавляются или удаляются файлы."""
+    while True:
+        await asyncio.sleep(REFRESH_INTERVAL)
+        try:
+            mtime = (await asyncio.to_thread(os.stat, MEME_FOLDER)).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        except Exception as e:
+            logging.warning(f"Не удалось проверить папку с мемами: {e}")
+            continue
+        if mtime != _folder_mtime:
+            await build_index()
+
+
+def next_meme(user_id: int) -> tuple[str, str] | None:
+    """
+    Выбирает случайный мем, который пользователь еще не видел в текущем круге.
+    Возвращает путь и хэш содержимого для media.answer_photo.
+    Последний мем круга сразу отмечается в новом круге, чтобы он не повторился два раза подряд.
+    """
+    total = len(_index)
+    if not total:
+        return None
+    seen = _seen.get(user_id, 0)
+    unseen = [i for i in range(total) if not seen >> i & 1]
+    if not unseen:
+        unseen = list(range(total))
+        seen = 0
+    idx = random.choice(unseen)
+    seen |= 1 << idx
+    if seen == (1 << total) - 1:
+        seen = 1 << idx
+    _seen[user_id] = seen
+    return _index[idx]
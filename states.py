@@ -1,4 +1,7 @@
+from typing import Annotated, Mapping
+
 from aiogram.fsm.state import State, StatesGroup
+from pydantic import BaseModel, ConfigDict, Field
 
 class TestStates(StatesGroup):
     CHOOSE_TEST = State()
@@ -22,3 +25,39 @@ class Day5States(StatesGroup):
     REFLECTION = State()
 
 
+# --- Схема данных состояния ---
+# Данные FSM сохраняются в БД, поэтому в них допускаются только перечисленные поля
+# с небольшими значениями: номера вопросов, счетчики и ссылки на сообщения.
+SmallInt = Annotated[int, Field(ge=0, le=10_000)]
+Scores = dict[Annotated[str, Field(max_length=64)], int]
+# Ссылка на сообщение: (chat_id, message_id), см. utils.message_ref
+MessageRef = tuple[int, int]
+
+class FSMData(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
+    # День 1
+    disc_q: SmallInt | None = None
+    disc_scores: Scores | None = None
+    fun_q: SmallInt | None = None
+    fun_scores: Scores | None = None
+    # День 2: (message_id, путь к картинке), показанные в сообщении с карточками
+    day2_shown_media: tuple[int, Annotated[str, Field(max_length=255)]] | None = None
+    # День 3
+    hero_idx: SmallInt | None = None
+    hero: Annotated[str, Field(max_length=32)] | None = None
+    frame: SmallInt | None = None
+    scores: Scores | None = None
+    quiz_q: SmallInt | None = None
+    quiz_score: SmallInt | None = None
+    # День 4
+    case_idx: SmallInt | None = None
+    sent_messages: Annotated[list[MessageRef], Field(max_length=10)] | None = None
+    # День 5
+    q_idx: SmallInt | None = None
+    correct_answers: SmallInt | None = None
+    user_id: int | None = None
+
+def validate_data(data: Mapping) -> None:
+    """Проверяет данные состояния по схеме FSMData, при ошибке бросает ValidationError."""
+    FSMData.model_validate(data)
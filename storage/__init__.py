@@ -0,0 +1,25 @@
+"""
+Хранилища данных бота. Реализация выбирается параметром DB_BACKEND в config.py:
+postgres (asyncpg, по умолчанию), sqlite (aiosqlite) или memory (без сохранения на диск,
+для пилотов и нагрузочных тестов).
+"""
+from storage.base import Storage
+
+BACKENDS = ("postgres", "sqlite", "memory")
+
+
+def create_storage(backend: str) -> Storage:
+    # Драйверы импортируются только для выбранного хранилища
+    if backend == "postgres":
+        from storage.postgres import PostgresStorage
+        return PostgresStorage()
+    if backend == "sqlite":
+        from storage.sqlite import SQLiteStorage
+        return SQLiteStorage()
+    if backend == "memory":
+        from storage.memory import MemoryStorage
+        return MemoryStorage()
+    raise ValueError(f"Неизвестное хранилище DB_BACKEND={backend!r}, доступны: {', '.join(BACKENDS)}")
+
+
+__all__ = ["Storage", "BACKENDS", "create_storage"]
@@ -0,0 +1,156 @@
+from abc import ABC, abstractmethod
+
+# Выгрузка открывается в Excel: разделитель ';', UTF-8 с BOM
+EXPORT_DELIMITER = ";"
+EXPORT_RESULTS_SEPARATOR = " | "
+
+
+def export_columns(event_days):
+    return ["id", "username", "full_name", "points", "results"] + [f"day_{day}" for day in range(1, event_days + 1)] + ["reflection"]
+
+
+class Storage(ABC):
+    """
+    Интерфейс хранилища данных бота: пользователи, прогресс по дням, дни, состояние бота
+    и кэш file_id. Все операции записи атомарны в пределах одного вызова.
+    Значения JSON-полей (rewards, results, data) возвращаются уже декодированными.
+    """
+    name = "base"
+
+    @abstractmethod
+    async def connect(self):
+        """Открывает соединение и приводит схему к актуальной версии."""
+
+    @abstractmethod
+    async def close(self):
+        """Сохраняет отложенные изменения и закрывает соединение."""
+
+    # --- Уведомления об изменениях ---
+    async def subscribe(self, channel, callback, on_lost):
+        """
+        Подписывает callback(payload) на изменения, сделанные другими процессами.
+        Возвращает False, если хранилище доступно только одному процессу и подписка не нужна.
+        """
+        return False
+
+    async def unsubscribe(self):
+        pass
+
+    async def notify(self, channel, payload):
+        pass
+
+    # --- Дни ---
+    @abstractmethod
+    async def init_days(self, event_days) -> bool:
+        """Добавляет недостающие дни, первый день открыт. Возвращает True, если что-то добавлено."""
+
+    @abstractmethod
+    async def open_next_day(self) -> int | None: ...
+
+    @abstractmethod
+    async def close_last_day(self) -> int | None: ...
+
+    @abstractmethod
+    async def get_open_days(self) -> list[int]: ...
+
+    # --- Состояние бота ---
+    @abstractmethod
+    async def get_bot_state(self, key) -> str | None: ...
+
+    @abstractmethod
+    async def set_bot_state(self, key, value: str): ...
+
+    # --- Кэш file_id медиафайлов ---
+    @abstractmethod
+    async def get_media_file_id(self, path, content_hash) -> str | None: ...
+
+    @abstractmethod
+    async def get_all_media_file_ids(self) -> dict: ...
+
+    @abstractmethod
+    async def save_media_file_id(self, path, content_hash, file_id): ...
+
+    @abstractmethod
+    async def delete_media_file_id(self, path, content_hash): ...
+
+    @abstractmethod
+    async def delete_media_file_ids(self, paths):
+        """Удаляет file_id всех версий файлов paths, например после удаления самих файлов."""
+
+    # --- Состояния FSM ---
+    @abstractmethod
+    async def get_fsm_record(self, key) -> tuple[str | None, bytes | None] | None:
+        """Возвращает (state, data) для ключа FSM или None, если записи нет."""
+
+    @abstractmethod
+    async def get_fsm_records(self) -> list[tuple[str, str | None, bytes | None]]:
+        """Все записи FSM (key, state, data) для отчетов."""
+
+    @abstractmethod
+    async def save_fsm_records(self, records: list[tuple[str, str | None, bytes | None]]):
+        """
+        Сохраняет записи (key, state, data) одной операцией. Запись без состояния и данных
+        удаляется.
+        """
+
+    @abstractmethod
+    async def expire_fsm_records(self, ttl) -> int:
+        """Удаляет записи FSM без изменений дольше ttl секунд. Возвращает их число."""
+
+    # --- Пользователи ---
+    @abstractmethod
+    async def upsert_user(self, user_id, username, full_name) -> str | None:
+        """Создает пользователя или обновляет username, если он изменился. Возвращает 'created', 'updated' или None."""
+
+    @abstractmethod
+    async def award_points(self, user_id, award_key, points) -> bool:
+        """Записывает начисление в журнал баллов и меняет баланс. Повтор с тем же ключом ничего не делает."""
+
+    @abstractmethod
+    async def get_leaderboard(self) -> list[dict]:
+        """Все пользователи (id, username, full_name, points) по убыванию баллов."""
+
+    @abstractmethod
+    async def recompute_points(self) -> int:
+        """Пересчитывает баланс всех пользователей по журналу. Возвращает число исправленных балансов."""
+
+    @abstractmethod
+    async def get_profile(self, user_id) -> dict | None: ...
+
+    @abstractmethod
+    async def get_profile_snapshot(self, user_id) -> dict | None:
+        """Профиль вместе с completed_days и progress (номер_дня -> data)."""
+
+    @abstractmethod
+    async def save_full_name(self, user_id, full_name): ...
+
+    @abstractmethod
+    async def get_certificate_candidates(self, min_points) -> list[dict]: ...
+
+    @abstractmethod
+    async def add_result(self, user_id, result_text) -> bool: ...
+
+    @abstractmethod
+    async def reset_user_progress(self, user_id): ...
+
+    @abstractmethod
+    async def export_users_csv(self, path, event_days) -> int:
+        """
+        Выгружает пользователей в CSV с колонками export_columns потоково, не загружая всех
+        в память. Возвращает число выгруженных строк.
+        """
+
+    # --- Прогресс по дням ---
+    @abstractmethod
+    async def get_day_progress(self, user_id, day_number) -> dict: ...
+
+    @abstractmethod
+    async def update_day_progress_data(self, user_id, day_number, new_data_dict): ...
+
+    @abstractmethod
+    async def append_day_progress_item(self, user_id, day_number, key, item, award_key=None, points=0) -> bool:
+        """Если элемент добавлен и задан award_key, в той же операции начисляет points по журналу."""
+
+    @abstractmethod
+    async def complete_day(self, user_id, day_number, points, result, reflection, progress, result_once) -> bool:
+        """Баллы за завершение записываются в журнал с ключом day{N}:complete."""
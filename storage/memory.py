@@ -0,0 +1,225 @@
+import copy
+import csv
+import time
+
+from storage.base import Storage, EXPORT_DELIMITER, EXPORT_RESULTS_SEPARATOR, export_columns
+
+
+class MemoryStorage(Storage):
+    """
+    Хранилище в памяти процесса: данные теряются при перезапуске. Подходит для нагрузочных
+    тестов обработчиков без затрат на БД. Каждая операция выполняется без await внутри,
+    поэтому атомарна относительно других корутин.
+    """
+    name = "memory"
+
+    def __init__(self):
+        self.users: dict[int, dict] = {}
+        self.progress: dict[tuple[int, int], dict] = {}
+        self.days: dict[int, bool] = {}
+        self.bot_state: dict[str, str] = {}
+        self.media_cache: dict[tuple[str, str], str] = {}
+        self.points_ledger: dict[tuple[int, str], int] = {}
+        # key -> (state, data, время изменения)
+        self.fsm_state: dict[str, tuple[str | None, bytes | None, float]] = {}
+
+    async def connect(self):
+        print("LOG: Используется хранилище в памяти, данные не сохраняются между запусками.")
+
+    async def close(self):
+        pass
+
+    def _progress_row(self, user_id, day_number):
+        return self.progress.setdefault((user_id, day_number), {"completed": 0, "data": {}})
+
+    # --- Дни ---
+    async def init_days(self, event_days):
+        missing = [day for day in range(1, event_days + 1) if day not in self.days]
+        for day in missing:
+            self.days[day] = day == 1
+        return bool(missing)
+
+    async def open_next_day(self):
+        for day in sorted(self.days):
+            if not self.days[day]:
+                self.days[day] = True
+                return day
+        return None
+
+    async def close_last_day(self):
+        open_days = await self.get_open_days()
+        if open_days and open_days[-1] > 1:
+            self.days[open_days[-1]] = False
+            return open_days[-1]
+        return None
+
+    async def get_open_days(self):
+        return sorted(day for day, is_open in self.days.items() if is_open)
+
+    # --- Состояние бота ---
+    async def get_bot_state(self, key):
+        return self.bot_state.get(key)
+
+    async def set_bot_state(self, key, value):
+        self.bot_state[key] = value
+
+    # --- Кэш file_id медиафайлов ---
+    async def get_media_file_id(self, path, content_hash):
+        return self.media_cache.get((path, content_hash))
+
+    async def get_all_media_file_ids(self):
+        return dict(self.media_cache)
+
+    async def save_media_file_id(self, path, content_hash, file_id):
+        self.media_cache[(path, content_hash)] = file_id
+
+    async def delete_media_file_id(self, path, content_hash):
+        self.media_cache.pop((path, content_hash), None)
+
+    async def delete_media_file_ids(self, paths):
+        paths = set(paths)
+        for key in [key for key in self.media_cache if key[0] in paths]:
+            del self.media_cache[key]
+
+    # --- Состояния FSM ---
+    async def get_fsm_record(self, key):
+        record = self.fsm_state.get(key)
+        return record[:2] if record else None
+
+    async def get_fsm_records(self):
+        return [(key, state, data) for key, (state, data, _) in self.fsm_state.items()]
+
+    async def save_fsm_records(self, records):
+        for key, state, data in records:
+            if state is None and data is None:
+                self.fsm_state.pop(key, None)
+            else:
+                self.fsm_state[key] = (state, data, time.time())
+
+    async def expire_fsm_records(self, ttl):
+        cutoff = time.time() - ttl
+        expired = [key for key, (_, _, updated_at) in self.fsm_state.items() if updated_at < cutoff]
+        for key in expired:
+            del self.fsm_state[key]
+        return len(expired)
+
+    # --- Пользователи ---
+    async def upsert_user(self, user_id, username, full_name):
+        user = self.users.get(user_id)
+        if user is None:
+            self.users[user_id] = {
+                "id": user_id, "username": username, "points": 0, "rewards": [],
+                "results": [], "reflection": None, "full_name": full_name,
+            }
+            return "created"
+        if user["username"] != username:
+            user["username"] = username
+            return "updated"
+        return None
+
+    async def award_points(self, user_id, award_key, points):
+        if user_id not in self.users or (user_id, award_key) in self.points_ledger:
+            return False
+        self.points_ledger[(user_id, award_key)] = points
+        self.users[user_id]["points"] += points
+        return True
+
+    async def get_leaderboard(self):
+        users = sorted(self.users.values(), key=lambda user: user["points"], reverse=True)
+        return [{key: user[key] for key in ("id", "username", "full_name", "points")} for user in users]
+
+    async def recompute_points(self):
+        totals = dict.fromkeys(self.users, 0)
+        for (user_id, _), points in self.points_ledger.items():
+            totals[user_id] = totals.get(user_id, 0) + points
+        fixed = 0
+        for user_id, user in self.users.items():
+            if user["points"] != totals[user_id]:
+                user["points"] = totals[user_id]
+                fixed += 1
+        return fixed
+
+    async def get_profile(self, user_id):
+        user = self.users.get(user_id)
+        return copy.deepcopy(user) if user else None
+
+    async def get_profile_snapshot(self, user_id):
+        snapshot = await self.get_profile(user_id)
+        if snapshot is None:
+            return None
+        rows = {day: row for (uid, day), row in self.progress.items() if uid == user_id}
+        snapshot["completed_days"] = sum(1 for row in rows.values() if row["completed"] == 1)
+        snapshot["progress"] = {day: copy.deepcopy(row["data"]) for day, row in rows.items()}
+        return snapshot
+
+    async def save_full_name(self, user_id, full_name):
+        if user_id in self.users:
+            self.users[user_id]["full_name"] = full_name
+
+    async def get_certificate_candidates(self, min_points):
+        candidates = []
+        for user in self.users.values():
+            data = self.progress.get((user["id"], 5), {}).get("data", {})
+            if user["points"] >= min_points and data.get("quiz_completed") is True and data.get("reflection_completed") is True:
+                candidates.append({key: user[key] for key in ("id", "username", "full_name", "points")})
+        return candidates
+
+    async def add_result(self, user_id, result_text):
+        user = self.users.get(user_id)
+        if user is None or result_text in user["results"]:
+            return False
+        user["results"].append(result_text)
+        return True
+
+    async def reset_user_progress(self, user_id):
+        user = self.users.get(user_id)
+        if user is not None:
+            user.update(points=0, rewards=[], results=[], reflection=None)
+        for key in [key for key in self.progress if key[0] == user_id]:
+            del self.progress[key]
+        for key in [key for key in self.points_ledger if key[0] == user_id]:
+            del self.points_ledger[key]
+
+    async def export_users_csv(self, path, event_days):
+        with open(path, "w", encoding="utf-8-sig", newline="") as f:
+            writer = csv.writer(f, delimiter=EXPORT_DELIMITER)
+            writer.writerow(export_columns(event_days))
+            for user_id in sorted(self.users):
+                user = self.users[user_id]
+                days = [int(self.progress.get((user_id, day), {}).get("completed") == 1) for day in range(1, event_days + 1)]
+                writer.writerow([
+                    user_id, user["username"], user["full_name"], user["points"],
+                    EXPORT_RESULTS_SEPARATOR.join(user["results"]) or None, *days, user["reflection"],
+                ])
+        return len(self.users)
+
+    # --- Прогресс по дням ---
+    async def get_day_progress(self, user_id, day_number):
+        row = self.progress.get((user_id, day_number))
+        return copy.deepcopy(row["data"]) if row else {}
+
+    async def update_day_progress_data(self, user_id, day_number, new_data_dict):
+        self._progress_row(user_id, day_number)["data"].update(copy.deepcopy(new_data_dict))
+
+    async def append_day_progress_item(self, user_id, day_number, key, item, award_key=None, points=0):
+        items = self._progress_row(user_id, day_number)["data"].setdefault(key, [])
+        if item in items:
+            return False
+        items.append(item)
+        if award_key is not None:
+            await self.award_points(user_id, award_key, points)
+        return True
+
+    async def complete_day(self, user_id, day_number, points, result, reflection, progress, result_once):
+        row = self._progress_row(user_id, day_number)
+        first_time = row["completed"] != 1
+        if first_time:
+            row["completed"] = 1
+            row["data"].update(copy.deepcopy(progress or {}))
+            if points:
+                await self.award_points(user_id, f"day{day_number}:complete", points)
+            if reflection is not None and user_id in self.users:
+                self.users[user_id]["reflection"] = reflection
+        if result is not None and (first_time or not result_once):
+            await self.add_result(user_id, result)
+        return first_time
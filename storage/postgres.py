@@ -0,0 +1,469 @@
+import json
+
+import asyncpg
+
+from config import DB_HOST, DB_PORT, DB_USER, DB_PASS, DB_NAME
+from storage.base import Storage, EXPORT_DELIMITER, EXPORT_RESULTS_SEPARATOR
+
+# --- Миграции схемы ---
+# Каждая миграция применяется один раз; номер последней примененной хранится в schema_version.
+# Новые изменения схемы добавляются в конец списка, уже выпущенные миграции не редактируются.
+MIGRATIONS = [
+    (1, "Базовые таблицы", '''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at TIMESTAMPTZ DEFAULT now()
+        );
+        CREATE TABLE IF NOT EXISTS users (
+            id BIGINT PRIMARY KEY,
+            username TEXT,
+            points INTEGER DEFAULT 0,
+            rewards JSONB DEFAULT '[]'::jsonb,
+            results JSONB DEFAULT '[]'::jsonb,
+            reflection TEXT
+        );
+        CREATE TABLE IF NOT EXISTS daily_progress (
+            user_id BIGINT,
+            day_number INTEGER,
+            completed INTEGER DEFAULT 0,
+            data JSONB DEFAULT '{}'::jsonb,
+            PRIMARY KEY (user_id, day_number),
+            FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+        );
+        CREATE TABLE IF NOT EXISTS bot_state (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        );
+        CREATE TABLE IF NOT EXISTS days (
+            day_number INTEGER PRIMARY KEY,
+            is_open BOOLEAN DEFAULT FALSE
+        );
+    '''),
+    (2, "Кэш file_id медиафайлов", '''
+        CREATE TABLE IF NOT EXISTS media_cache (
+            path TEXT,
+            content_hash TEXT,
+            file_id TEXT NOT NULL,
+            PRIMARY KEY (path, content_hash)
+        );
+    '''),
+    (3, "Имя пользователя для сертификата", '''
+        ALTER TABLE users ADD COLUMN IF NOT EXISTS full_name TEXT;
+    '''),
+    (4, "Индексы для выборок по дням и по баллам", '''
+        CREATE INDEX IF NOT EXISTS daily_progress_day_completed_idx ON daily_progress (day_number, completed);
+        CREATE INDEX IF NOT EXISTS users_points_idx ON users (points DESC);
+    '''),
+    (5, "Журнал начисления баллов", '''
+        CREATE TABLE IF NOT EXISTS points_ledger (
+            user_id BIGINT REFERENCES users (id) ON DELETE CASCADE,
+            award_key TEXT,
+            points INTEGER NOT NULL,
+            created_at TIMESTAMPTZ DEFAULT now(),
+            PRIMARY KEY (user_id, award_key)
+        );
+        -- Баллы, начисленные до появления журнала, переносятся одной записью
+        INSERT INTO points_ledger (user_id, award_key, points)
+        SELECT id, 'legacy:balance', points FROM users WHERE points <> 0
+        ON CONFLICT DO NOTHING;
+    '''),
+    (6, "Состояния FSM", '''
+        CREATE TABLE IF NOT EXISTS fsm_state (
+            key TEXT PRIMARY KEY,
+            state TEXT,
+            data BYTEA,
+            updated_at TIMESTAMPTZ DEFAULT now()
+        );
+    '''),
+    (7, "Индекс по времени изменения состояний FSM", '''
+        CREATE INDEX IF NOT EXISTS fsm_state_updated_at_idx ON fsm_state (updated_at);
+    '''),
+]
+
+
+def _decode_json(value, default):
+    """asyncpg возвращает JSONB строкой, декодируем ее один раз на стороне хранилища."""
+    if value is None:
+        return default
+    if isinstance(value, str):
+        return json.loads(value) if value else default
+    return value
+
+
+def _decode_user(row):
+    if not row:
+        return None
+    user = dict(row)
+    user['rewards'] = _decode_json(user.get('rewards'), [])
+    user['results'] = _decode_json(user.get('results'), [])
+    return user
+
+
+class PostgresStorage(Storage):
+    name = "postgres"
+
+    def __init__(self):
+        self.pool: asyncpg.Pool | None = None
+        self._listener: asyncpg.Connection | None = None
+        self._on_listener_lost = None
+
+    def _connect_args(self):
+        return dict(user=DB_USER, password=DB_PASS, database=DB_NAME, host=DB_HOST, port=DB_PORT)
+
+    async def connect(self):
+        print("LOG: Создание пула соединений с PostgreSQL...")
+        try:
+            self.pool = await asyncpg.create_pool(**self._connect_args())
+            print("LOG: Пул соединений успешно создан.")
+        except Exception as e:
+            print(f"FATAL: Не удалось подключиться к PostgreSQL: {e}")
+            raise
+        await self._migrate()
+
+    async def close(self):
+        await self.unsubscribe()
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+
+    async def _get_schema_version(self, conn):
+        # Запрос к pg_tables, а не to_regclass: кэш каталога не обновляется после advisory-блокировки,
+        # и копия, дождавшаяся чужих миграций, не увидела бы созданную ими таблицу
+        exists = await conn.fetchval(
+            "SELECT EXISTS (SELECT 1 FROM pg_tables WHERE schemaname = current_schema() AND tablename = 'schema_version')"
+        )
+        if not exists:
+            return 0
+        return await conn.fetchval('SELECT COALESCE(MAX(version), 0) FROM schema_version')
+
+    async def _migrate(self):
+        """Применяет недостающие миграции. Если схема актуальна, DDL не выполняется."""
+        latest = MIGRATIONS[-1][0]
+        async with self.pool.acquire() as conn:
+            if await self._get_schema_version(conn) >= latest:
+                print(f"LOG: Схема БД актуальна (версия {latest}).")
+                return
+            async with conn.transaction():
+                # Блокировка не дает нескольким копиям бота применять миграции одновременно
+                await conn.execute('SELECT pg_advisory_xact_lock(hashtext(\'schema_version\'))')
+                current = await self._get_schema_version(conn)
+                for version, description, sql in MIGRATIONS:
+                    if version <= current:
+                        continue
+                    await conn.execute(sql)
+                    await conn.execute(
+                        'INSERT INTO schema_version (version, description) VALUES ($1, $2)',
+                        version, description
+                    )
+                    print(f"LOG: Применена миграция {version}: {description}")
+
+    # --- Уведомления об изменениях ---
+    async def subscribe(self, channel, callback, on_lost):
+        """Слушает канал на отдельном соединении, которое не возвращается в пул."""
+        def on_notification(connection, pid, channel, payload):
+            callback(payload)
+
+        def on_closed(connection):
+            self._listener = None
+            on_lost()
+
+        listener = await asyncpg.connect(**self._connect_args())
+        try:
+            await listener.add_listener(channel, on_notification)
+        except BaseException:
+            await listener.close()
+            raise
+        listener.add_termination_listener(on_closed)
+        self._listener = listener
+        self._on_listener_lost = on_closed
+        return True
+
+    async def unsubscribe(self):
+        listener, self._listener = self._listener, None
+        if listener is not None:
+            listener.remove_termination_listener(self._on_listener_lost)
+            await listener.close()
+
+    async def notify(self, channel, payload):
+        await self.pool.execute('SELECT pg_notify($1, $2)', channel, payload)
+
+    # --- Дни ---
+    async def init_days(self, event_days):
+        result = await self.pool.execute(
+            'INSERT INTO days (day_number, is_open) SELECT d, d = 1 FROM generate_series(1, $1::int) AS d '
+            'ON CONFLICT (day_number) DO NOTHING',
+            event_days
+        )
+        return result != 'INSERT 0 0'
+
+    async def open_next_day(self):
+        return await self.pool.fetchval('''
+            UPDATE days SET is_open = TRUE
+            WHERE day_number = (SELECT day_number FROM days WHERE is_open = FALSE ORDER BY day_number LIMIT 1)
+            RETURNING day_number
+        ''')
+
+    async def close_last_day(self):
+        return await self.pool.fetchval('''
+            UPDATE days SET is_open = FALSE
+            WHERE day_number = (SELECT day_number FROM days WHERE is_open = TRUE ORDER BY day_number DESC LIMIT 1)
+              AND day_number > 1
+            RETURNING day_number
+        ''')
+
+    async def get_open_days(self):
+        records = await self.pool.fetch('SELECT day_number FROM days WHERE is_open = TRUE ORDER BY day_number')
+        return [record['day_number'] for record in records]
+
+    # --- Состояние бота ---
+    async def get_bot_state(self, key):
+        return await self.pool.fetchval('SELECT value FROM bot_state WHERE key = $1', key)
+
+    async def set_bot_state(self, key, value):
+        await self.pool.execute('INSERT INTO bot_state (key, value) VALUES ($1, $2) ON CONFLICT (key) DO UPDATE SET value = $2', key, value)
+
+    # --- Кэш file_id медиафайлов ---
+    async def get_media_file_id(self, path, content_hash):
+        return await self.pool.fetchval('SELECT file_id FROM media_cache WHERE path = $1 AND content_hash = $2', path, content_hash)
+
+    async def get_all_media_file_ids(self):
+        records = await self.pool.fetch('SELECT path, content_hash, file_id FROM media_cache')
+        return {(r['path'], r['content_hash']): r['file_id'] for r in records}
+
+    async def save_media_file_id(self, path, content_hash, file_id):
+        await self.pool.execute(
+            'INSERT INTO media_cache (path, content_hash, file_id) VALUES ($1, $2, $3) '
+            'ON CONFLICT (path, content_hash) DO UPDATE SET file_id = $3',
+            path, content_hash, file_id
+        )
+
+    async def delete_media_file_id(self, path, content_hash):
+        await self.pool.execute('DELETE FROM media_cache WHERE path = $1 AND content_hash = $2', path, content_hash)
+
+    async def delete_media_file_ids(self, paths):
+        await self.pool.execute('DELETE FROM media_cache WHERE path = ANY($1::text[])', list(paths))
+
+    # --- Состояния FSM ---
+    async def get_fsm_record(self, key):
+        row = await self.pool.fetchrow('SELECT state, data FROM fsm_state WHERE key = $1', key)
+        return (row['state'], row['data']) if row else None
+
+    async def get_fsm_records(self):
+        rows = await self.pool.fetch('SELECT key, state, data FROM fsm_state')
+        return [(row['key'], row['state'], row['data']) for row in rows]
+
+    async def save_fsm_records(self, records):
+        upserts = [record for record in records if record[1] is not None or record[2] is not None]
+        deletes = [record[0] for record in records if record[1] is None and record[2] is None]
+        async with self.pool.acquire() as conn, conn.transaction():
+            if upserts:
+                # Все записи одним запросом, независимо от их количества
+                keys, states, blobs = zip(*upserts)
+                await conn.execute('''
+                    INSERT INTO fsm_state (key, state, data)
+                    SELECT * FROM unnest($1::text[], $2::text[], $3::bytea[])
+                    ON CONFLICT (key) DO UPDATE
+                    SET state = EXCLUDED.state, data = EXCLUDED.data, updated_at = now()
+                ''', keys, states, blobs)
+            if deletes:
+                await conn.execute('DELETE FROM fsm_state WHERE key = ANY($1::text[])', deletes)
+
+    async def expire_fsm_records(self, ttl):
+        result = await self.pool.execute(
+            'DELETE FROM fsm_state WHERE updated_at < now() - make_interval(secs => $1)', float(ttl)
+        )
+        return int(result.split()[-1])
+
+    # --- Пользователи ---
+    async def upsert_user(self, user_id, username, full_name):
+        row = await self.pool.fetchrow('''
+            INSERT INTO users (id, username, full_name) VALUES ($1, $2, $3)
+            ON CONFLICT (id) DO UPDATE SET username = EXCLUDED.username
+            WHERE users.username IS DISTINCT FROM EXCLUDED.username
+            RETURNING (xmax = 0) AS inserted
+        ''', user_id, username, full_name)
+        if not row:
+            return None
+        return "created" if row['inserted'] else "updated"
+
+    async def award_points(self, user_id, award_key, points):
+        # Запись в журнал и изменение баланса в одном запросе; при повторе ключа баланс не меняется
+        awarded = await self.pool.fetchval('''
+            WITH awarded AS (
+                INSERT INTO points_ledger (user_id, award_key, points) VALUES ($1, $2, $3)
+                ON CONFLICT (user_id, award_key) DO NOTHING
+                RETURNING points
+            )
+            UPDATE users SET points = users.points + awarded.points
+            FROM awarded
+            WHERE users.id = $1
+            RETURNING TRUE
+        ''', user_id, award_key, points)
+        return bool(awarded)
+
+    async def get_leaderboard(self):
+        records = await self.pool.fetch('SELECT id, username, full_name, points FROM users ORDER BY points DESC')
+        return [dict(r) for r in records]
+
+    async def recompute_points(self):
+        result = await self.pool.execute('''
+            UPDATE users u SET points = totals.points
+            FROM (
+                SELECT u2.id, COALESCE(SUM(l.points), 0) AS points
+                FROM users u2
+                LEFT JOIN points_ledger l ON l.user_id = u2.id
+                GROUP BY u2.id
+            ) totals
+            WHERE u.id = totals.id AND u.points IS DISTINCT FROM totals.points
+        ''')
+        return int(result.split()[-1])
+
+    async def get_profile(self, user_id):
+        return _decode_user(await self.pool.fetchrow('SELECT * FROM users WHERE id = $1', user_id))
+
+    async def get_profile_snapshot(self, user_id):
+        row = await self.pool.fetchrow('''
+            SELECT u.*,
+                   COALESCE(p.completed_days, 0) AS completed_days,
+                   COALESCE(p.progress, '{}'::jsonb) AS progress
+            FROM users u
+            LEFT JOIN LATERAL (
+                SELECT COUNT(*) FILTER (WHERE completed = 1) AS completed_days,
+                       jsonb_object_agg(day_number, data) AS progress
+                FROM daily_progress
+                WHERE user_id = u.id
+            ) p ON TRUE
+            WHERE u.id = $1
+        ''', user_id)
+        snapshot = _decode_user(row)
+        if snapshot:
+            snapshot['progress'] = {int(day): data or {} for day, data in _decode_json(snapshot['progress'], {}).items()}
+        return snapshot
+
+    async def save_full_name(self, user_id, full_name):
+        await self.pool.execute('UPDATE users SET full_name = $1 WHERE id = $2', full_name, user_id)
+
+    async def get_certificate_candidates(self, min_points):
+        records = await self.pool.fetch('''
+            SELECT u.id, u.username, u.full_name, u.points
+            FROM users u
+            JOIN daily_progress dp ON dp.user_id = u.id AND dp.day_number = 5
+            WHERE u.points >= $1
+              AND dp.data @> '{"quiz_completed": true, "reflection_completed": true}'::jsonb
+        ''', min_points)
+        return [dict(r) for r in records]
+
+    async def add_result(self, user_id, result_text):
+        # Дубликаты отсекаются проверкой вхождения в JSONB в том же запросе
+        added = await self.pool.fetchval('''
+            UPDATE users
+            SET results = COALESCE(results, '[]'::jsonb) || jsonb_build_array($2::text)
+            WHERE id = $1 AND NOT COALESCE(results, '[]'::jsonb) @> jsonb_build_array($2::text)
+            RETURNING TRUE
+        ''', user_id, result_text)
+        return bool(added)
+
+    async def reset_user_progress(self, user_id):
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute(
+                    "UPDATE users SET points = 0, rewards = '[]'::jsonb, results = '[]'::jsonb, reflection = NULL WHERE id = $1",
+                    user_id
+                )
+                await conn.execute('DELETE FROM daily_progress WHERE user_id = $1', user_id)
+                await conn.execute('DELETE FROM points_ledger WHERE user_id = $1', user_id)
+
+    async def export_users_csv(self, path, event_days):
+        day_columns = ", ".join(f"COALESCE(d.day_{day}, FALSE)::int AS day_{day}" for day in range(1, event_days + 1))
+        day_aggregates = ", ".join(f"bool_or(day_number = {day} AND completed = 1) AS day_{day}" for day in range(1, event_days + 1))
+        query = f'''
+            SELECT u.id, u.username, u.full_name, u.points,
+                   (SELECT string_agg(r, '{EXPORT_RESULTS_SEPARATOR}') FROM jsonb_array_elements_text(COALESCE(u.results, '[]'::jsonb)) r) AS results,
+                   {day_columns},
+                   u.reflection
+            FROM users u
+            LEFT JOIN LATERAL (
+                SELECT {day_aggregates}
+                FROM daily_progress
+                WHERE user_id = u.id
+            ) d ON TRUE
+            ORDER BY u.id
+        '''
+        # COPY отдает строки потоком прямо в файл, память не зависит от числа пользователей
+        with open(path, "wb") as f:
+            f.write("\ufeff".encode())  # BOM, чтобы Excel распознал UTF-8
+            async with self.pool.acquire() as conn:
+                result = await conn.copy_from_query(query, output=f, format="csv", header=True, delimiter=EXPORT_DELIMITER)
+        return int(result.split()[-1])
+
+    # --- Прогресс по дням ---
+    async def get_day_progress(self, user_id, day_number):
+        data = await self.pool.fetchval('SELECT data FROM daily_progress WHERE user_id = $1 AND day_number = $2', user_id, day_number)
+        return _decode_json(data, {}) or {}
+
+    async def update_day_progress_data(self, user_id, day_number, new_data_dict):
+        # Слияние выполняется в БД, поэтому параллельные обновления разных полей не теряются
+        await self.pool.execute(
+            'INSERT INTO daily_progress (user_id, day_number, data) VALUES ($1, $2, $3::jsonb) '
+            'ON CONFLICT (user_id, day_number) DO UPDATE SET data = COALESCE(daily_progress.data, \'{}\'::jsonb) || EXCLUDED.data',
+            user_id, day_number, json.dumps(new_data_dict)
+        )
+
+    async def append_day_progress_item(self, user_id, day_number, key, item, award_key=None, points=0):
+        # Один запрос из CTE: добавленный элемент разрешает запись баллов в журнал и изменение баланса
+        return await self.pool.fetchval('''
+            WITH appended AS (
+                INSERT INTO daily_progress (user_id, day_number, data)
+                VALUES ($1, $2, jsonb_build_object($3::text, jsonb_build_array($4::jsonb)))
+                ON CONFLICT (user_id, day_number) DO UPDATE
+                SET data = COALESCE(daily_progress.data, '{}'::jsonb)
+                           || jsonb_build_object($3::text, COALESCE(daily_progress.data -> $3, '[]'::jsonb) || jsonb_build_array($4::jsonb))
+                WHERE NOT COALESCE(daily_progress.data -> $3, '[]'::jsonb) @> jsonb_build_array($4::jsonb)
+                RETURNING 1
+            ), ledger AS (
+                INSERT INTO points_ledger (user_id, award_key, points)
+                SELECT $1, $5::text, $6::int FROM appended WHERE $5::text IS NOT NULL
+                ON CONFLICT (user_id, award_key) DO NOTHING
+                RETURNING points
+            ), awarded AS (
+                UPDATE users SET points = users.points + ledger.points
+                FROM ledger
+                WHERE users.id = $1
+            )
+            SELECT EXISTS (SELECT 1 FROM appended)
+        ''', user_id, day_number, key, json.dumps(item), award_key, points)
+
+    async def complete_day(self, user_id, day_number, points, result, reflection, progress, result_once):
+        # Один запрос из CTE: отметка дня разрешает запись баллов в журнал, рефлексию и поля progress
+        return await self.pool.fetchval('''
+            WITH completed AS (
+                INSERT INTO daily_progress (user_id, day_number, completed, data)
+                VALUES ($1, $2, 1, $3::jsonb)
+                ON CONFLICT (user_id, day_number) DO UPDATE
+                SET completed = 1, data = COALESCE(daily_progress.data, '{}'::jsonb) || EXCLUDED.data
+                WHERE daily_progress.completed IS DISTINCT FROM 1
+                RETURNING 1
+            ), first_time AS (
+                SELECT EXISTS (SELECT 1 FROM completed) AS value
+            ), ledger AS (
+                INSERT INTO points_ledger (user_id, award_key, points)
+                SELECT $1, 'day' || $2 || ':complete', $4::int FROM first_time WHERE first_time.value AND $4::int <> 0
+                ON CONFLICT (user_id, award_key) DO NOTHING
+                RETURNING points
+            ), awarded AS (
+                UPDATE users
+                SET points = users.points + COALESCE((SELECT ledger.points FROM ledger), 0),
+                    reflection = CASE WHEN first_time.value AND $5::text IS NOT NULL THEN $5::text ELSE reflection END,
+                    results = CASE
+                        WHEN $6::text IS NULL
+                          OR NOT (first_time.value OR NOT $7::bool)
+                          OR COALESCE(results, '[]'::jsonb) @> jsonb_build_array($6::text)
+                        THEN results
+                        ELSE COALESCE(results, '[]'::jsonb) || jsonb_build_array($6::text)
+                    END
+                FROM first_time
+                WHERE id = $1
+            )
+            SELECT value FROM first_time
+        ''', user_id, day_number, json.dumps(progress or {}), points, reflection, result, result_once)
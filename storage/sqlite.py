@@ -0,0 +1,435 @@
+import asyncio
+import csv
+import json
+from contextlib import asynccontextmanager
+
+import aiosqlite
+
+from config import SQLITE_PATH, SQLITE_COMMIT_INTERVAL, SQLITE_COMMIT_BATCH
+from storage.base import Storage, EXPORT_DELIMITER, EXPORT_RESULTS_SEPARATOR, export_columns
+
+# Версия схемы хранится в PRAGMA user_version, правила те же, что и для миграций PostgreSQL
+MIGRATIONS = [
+    (1, "Базовые таблицы", '''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY,
+            username TEXT,
+            points INTEGER DEFAULT 0,
+            rewards TEXT DEFAULT '[]',
+            results TEXT DEFAULT '[]',
+            reflection TEXT
+        );
+        CREATE TABLE IF NOT EXISTS daily_progress (
+            user_id INTEGER,
+            day_number INTEGER,
+            completed INTEGER DEFAULT 0,
+            data TEXT DEFAULT '{}',
+            PRIMARY KEY (user_id, day_number),
+            FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+        );
+        CREATE TABLE IF NOT EXISTS bot_state (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        );
+        CREATE TABLE IF NOT EXISTS days (
+            day_number INTEGER PRIMARY KEY,
+            is_open INTEGER DEFAULT 0
+        );
+    '''),
+    (2, "Кэш file_id медиафайлов", '''
+        CREATE TABLE IF NOT EXISTS media_cache (
+            path TEXT,
+            content_hash TEXT,
+            file_id TEXT NOT NULL,
+            PRIMARY KEY (path, content_hash)
+        );
+    '''),
+    (3, "Имя пользователя для сертификата", '''
+        ALTER TABLE users ADD COLUMN full_name TEXT;
+    '''),
+    (4, "Индексы для выборок по дням и по баллам", '''
+        CREATE INDEX IF NOT EXISTS daily_progress_day_completed_idx ON daily_progress (day_number, completed);
+        CREATE INDEX IF NOT EXISTS users_points_idx ON users (points DESC);
+    '''),
+    (5, "Журнал начисления баллов", '''
+        CREATE TABLE IF NOT EXISTS points_ledger (
+            user_id INTEGER REFERENCES users (id) ON DELETE CASCADE,
+            award_key TEXT,
+            points INTEGER NOT NULL,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (user_id, award_key)
+        );
+        INSERT OR IGNORE INTO points_ledger (user_id, award_key, points)
+        SELECT id, 'legacy:balance', points FROM users WHERE points <> 0;
+    '''),
+    (6, "Состояния FSM", '''
+        CREATE TABLE IF NOT EXISTS fsm_state (
+            key TEXT PRIMARY KEY,
+            state TEXT,
+            data BLOB,
+            updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+        );
+    '''),
+    (7, "Индекс по времени изменения состояний FSM", '''
+        CREATE INDEX IF NOT EXISTS fsm_state_updated_at_idx ON fsm_state (updated_at);
+    '''),
+]
+
+
+def _dumps(value):
+    return json.dumps(value, ensure_ascii=False)
+
+
+def _loads(value, default):
+    return json.loads(value) if value else default
+
+
+def _decode_user(row):
+    if row is None:
+        return None
+    user = dict(row)
+    user['rewards'] = _loads(user.get('rewards'), [])
+    user['results'] = _loads(user.get('results'), [])
+    return user
+
+
+class SQLiteStorage(Storage):
+    """
+    Хранилище в файле SQLite для небольших пилотов без сервера PostgreSQL.
+
+    Используется одно соединение в режиме WAL. Записи выполняются под общей блокировкой и
+    фиксируются пачками: COMMIT происходит через SQLITE_COMMIT_INTERVAL секунд после первой
+    записи или сразу после SQLITE_COMMIT_BATCH записей. Каждая операция обернута в SAVEPOINT,
+    поэтому в пачку попадает либо вся операция, либо ничего. При аварийном завершении могут
+    потеряться записи за последний интервал.
+    """
+    name = "sqlite"
+
+    def __init__(self, path=SQLITE_PATH):
+        self.path = path
+        self.conn: aiosqlite.Connection | None = None
+        self._write_lock = asyncio.Lock()
+        self._commit_task: asyncio.Task | None = None
+        self._pending_writes = 0
+        self.commit_stats = {"commits": 0, "writes": 0}
+
+    async def connect(self):
+        # isolation_level=None: транзакциями управляем сами, чтобы объединять записи в пачки
+        self.conn = await aiosqlite.connect(self.path, isolation_level=None)
+        self.conn.row_factory = aiosqlite.Row
+        await self.conn.execute("PRAGMA journal_mode=WAL")
+        await self.conn.execute("PRAGMA synchronous=NORMAL")
+        await self.conn.execute("PRAGMA foreign_keys=ON")
+        print(f"LOG: Открыта база SQLite {self.path}")
+        await self._migrate()
+
+    async def close(self):
+        if self._commit_task is not None:
+            self._commit_task.cancel()
+            self._commit_task = None
+        if self.conn is not None:
+            async with self._write_lock:
+                await self._commit()
+            await self.conn.close()
+            self.conn = None
+
+    async def _migrate(self):
+        async with self.conn.execute("PRAGMA user_version") as cursor:
+            current = (await cursor.fetchone())[0]
+        latest = MIGRATIONS[-1][0]
+        if current >= latest:
+            print(f"LOG: Схема БД актуальна (версия {latest}).")
+            return
+        for version, description, sql in MIGRATIONS:
+            if version <= current:
+                continue
+            await self.conn.executescript(f"BEGIN;\n{sql}\nPRAGMA user_version = {version};\nCOMMIT;")
+            print(f"LOG: Применена миграция {version}: {description}")
+
+    # --- Пакетная запись ---
+    @asynccontextmanager
+    async def _transaction(self):
+        """Атомарная операция записи; фиксируется вместе с соседними операциями."""
+        async with self._write_lock:
+            if not self.conn.in_transaction:
+                await self.conn.execute("BEGIN IMMEDIATE")
+            await self.conn.execute("SAVEPOINT op")
+            try:
+                yield self.conn
+            except BaseException:
+                await self.conn.execute("ROLLBACK TO op")
+                await self.conn.execute("RELEASE op")
+                raise
+            await self.conn.execute("RELEASE op")
+            self._pending_writes += 1
+            if self._pending_writes >= SQLITE_COMMIT_BATCH:
+                await self._commit()
+            elif self._commit_task is None:
+                self._commit_task = asyncio.create_task(self._commit_later())
+
+    async def _commit_later(self):
+        await asyncio.sleep(SQLITE_COMMIT_INTERVAL)
+        async with self._write_lock:
+            self._commit_task = None
+            await self._commit()
+
+    async def _commit(self):
+        if self.conn.in_transaction:
+            await self.conn.execute("COMMIT")
+            self.commit_stats["commits"] += 1
+            self.commit_stats["writes"] += self._pending_writes
+        self._pending_writes = 0
+
+    async def _fetchone(self, sql, *params):
+        async with self.conn.execute(sql, params) as cursor:
+            return await cursor.fetchone()
+
+    async def _fetchall(self, sql, *params):
+        async with self.conn.execute(sql, params) as cursor:
+            return await cursor.fetchall()
+
+    async def _fetchval(self, sql, *params):
+        row = await self._fetchone(sql, *params)
+        return row[0] if row else None
+
+    # --- Дни ---
+    async def init_days(self, event_days):
+        async with self._transaction() as conn:
+            cursor = await conn.executemany(
+                'INSERT OR IGNORE INTO days (day_number, is_open) VALUES (?, ?)',
+                [(day, int(day == 1)) for day in range(1, event_days + 1)]
+            )
+            return cursor.rowcount > 0
+
+    async def open_next_day(self):
+        async with self._transaction() as conn:
+            day = await self._fetchval('SELECT day_number FROM days WHERE is_open = 0 ORDER BY day_number LIMIT 1')
+            if day:
+                await conn.execute('UPDATE days SET is_open = 1 WHERE day_number = ?', (day,))
+            return day
+
+    async def close_last_day(self):
+        async with self._transaction() as conn:
+            day = await self._fetchval('SELECT day_number FROM days WHERE is_open = 1 ORDER BY day_number DESC LIMIT 1')
+            if day and day > 1:
+                await conn.execute('UPDATE days SET is_open = 0 WHERE day_number = ?', (day,))
+                return day
+            return None
+
+    async def get_open_days(self):
+        rows = await self._fetchall('SELECT day_number FROM days WHERE is_open = 1 ORDER BY day_number')
+        return [row['day_number'] for row in rows]
+
+    # --- Состояние бота ---
+    async def get_bot_state(self, key):
+        return await self._fetchval('SELECT value FROM bot_state WHERE key = ?', key)
+
+    async def set_bot_state(self, key, value):
+        async with self._transaction() as conn:
+            await conn.execute('INSERT INTO bot_state (key, value) VALUES (?, ?) ON CONFLICT (key) DO UPDATE SET value = excluded.value', (key, value))
+
+    # --- Кэш file_id медиафайлов ---
+    async def get_media_file_id(self, path, content_hash):
+        return await self._fetchval('SELECT file_id FROM media_cache WHERE path = ? AND content_hash = ?', path, content_hash)
+
+    async def get_all_media_file_ids(self):
+        rows = await self._fetchall('SELECT path, content_hash, file_id FROM media_cache')
+        return {(r['path'], r['content_hash']): r['file_id'] for r in rows}
+
+    async def save_media_file_id(self, path, content_hash, file_id):
+        async with self._transaction() as conn:
+            await conn.execute(
+                'INSERT INTO media_cache (path, content_hash, file_id) VALUES (?, ?, ?) '
+                'ON CONFLICT (path, content_hash) DO UPDATE SET file_id = excluded.file_id',
+                (path, content_hash, file_id)
+            )
+
+    async def delete_media_file_id(self, path, content_hash):
+        async with self._transaction() as conn:
+            await conn.execute('DELETE FROM media_cache WHERE path = ? AND content_hash = ?', (path, content_hash))
+
+    async def delete_media_file_ids(self, paths):
+        async with self._transaction() as conn:
+            await conn.executemany('DELETE FROM media_cache WHERE path = ?', [(path,) for path in paths])
+
+    # --- Состояния FSM ---
+    async def get_fsm_record(self, key):
+        row = await self._fetchone('SELECT state, data FROM fsm_state WHERE key = ?', key)
+        return (row['state'], row['data']) if row else None
+
+    async def get_fsm_records(self):
+        rows = await self._fetchall('SELECT key, state, data FROM fsm_state')
+        return [(row['key'], row['state'], row['data']) for row in rows]
+
+    async def save_fsm_records(self, records):
+        async with self._transaction() as conn:
+            await conn.executemany(
+                'INSERT INTO fsm_state (key, state, data) VALUES (?, ?, ?) '
+                'ON CONFLICT (key) DO UPDATE SET state = excluded.state, data = excluded.data, updated_at = CURRENT_TIMESTAMP',
+                [record for record in records if record[1] is not None or record[2] is not None]
+            )
+            await conn.executemany(
+                'DELETE FROM fsm_state WHERE key = ?',
+                [(record[0],) for record in records if record[1] is None and record[2] is None]
+            )
+
+    async def expire_fsm_records(self, ttl):
+        async with self._transaction() as conn:
+            cursor = await conn.execute(
+                "DELETE FROM fsm_state WHERE updated_at < datetime('now', ?)", (f"-{int(ttl)} seconds",)
+            )
+            return cursor.rowcount
+
+    # --- Пользователи ---
+    async def upsert_user(self, user_id, username, full_name):
+        async with self._transaction() as conn:
+            row = await self._fetchone('SELECT username FROM users WHERE id = ?', user_id)
+            if row is None:
+                await conn.execute('INSERT INTO users (id, username, full_name) VALUES (?, ?, ?)', (user_id, username, full_name))
+                return "created"
+            if row['username'] != username:
+                await conn.execute('UPDATE users SET username = ? WHERE id = ?', (username, user_id))
+                return "updated"
+            return None
+
+    async def _award_points(self, conn, user_id, award_key, points):
+        cursor = await conn.execute(
+            'INSERT OR IGNORE INTO points_ledger (user_id, award_key, points) VALUES (?, ?, ?)',
+            (user_id, award_key, points)
+        )
+        if cursor.rowcount == 0:
+            return False
+        await conn.execute('UPDATE users SET points = points + ? WHERE id = ?', (points, user_id))
+        return True
+
+    async def award_points(self, user_id, award_key, points):
+        async with self._transaction() as conn:
+            return await self._award_points(conn, user_id, award_key, points)
+
+    async def get_leaderboard(self):
+        rows = await self._fetchall('SELECT id, username, full_name, points FROM users ORDER BY points DESC')
+        return [dict(row) for row in rows]
+
+    async def recompute_points(self):
+        async with self._transaction() as conn:
+            cursor = await conn.execute('''
+                UPDATE users SET points = COALESCE((SELECT SUM(points) FROM points_ledger WHERE user_id = users.id), 0)
+                WHERE points IS NOT COALESCE((SELECT SUM(points) FROM points_ledger WHERE user_id = users.id), 0)
+            ''')
+            return cursor.rowcount
+
+    async def get_profile(self, user_id):
+        return _decode_user(await self._fetchone('SELECT * FROM users WHERE id = ?', user_id))
+
+    async def get_profile_snapshot(self, user_id):
+        snapshot = await self.get_profile(user_id)
+        if snapshot is None:
+            return None
+        rows = await self._fetchall('SELECT day_number, completed, data FROM daily_progress WHERE user_id = ?', user_id)
+        snapshot['completed_days'] = sum(1 for row in rows if row['completed'] == 1)
+        snapshot['progress'] = {row['day_number']: _loads(row['data'], {}) for row in rows}
+        return snapshot
+
+    async def save_full_name(self, user_id, full_name):
+        async with self._transaction() as conn:
+            await conn.execute('UPDATE users SET full_name = ? WHERE id = ?', (full_name, user_id))
+
+    async def get_certificate_candidates(self, min_points):
+        rows = await self._fetchall('''
+            SELECT u.id, u.username, u.full_name, u.points
+            FROM users u
+            JOIN daily_progress dp ON dp.user_id = u.id AND dp.day_number = 5
+            WHERE u.points >= ?
+              AND json_extract(dp.data, '$.quiz_completed') = 1
+              AND json_extract(dp.data, '$.reflection_completed') = 1
+        ''', min_points)
+        return [dict(row) for row in rows]
+
+    async def _add_result(self, conn, user_id, result_text):
+        results = await self._fetchval('SELECT results FROM users WHERE id = ?', user_id)
+        results = _loads(results, [])
+        if result_text in results:
+            return False
+        results.append(result_text)
+        await conn.execute('UPDATE users SET results = ? WHERE id = ?', (_dumps(results), user_id))
+        return True
+
+    async def add_result(self, user_id, result_text):
+        async with self._transaction() as conn:
+            return await self._add_result(conn, user_id, result_text)
+
+    async def reset_user_progress(self, user_id):
+        async with self._transaction() as conn:
+            await conn.execute(
+                "UPDATE users SET points = 0, rewards = '[]', results = '[]', reflection = NULL WHERE id = ?",
+                (user_id,)
+            )
+            await conn.execute('DELETE FROM daily_progress WHERE user_id = ?', (user_id,))
+            await conn.execute('DELETE FROM points_ledger WHERE user_id = ?', (user_id,))
+
+    async def export_users_csv(self, path, event_days):
+        day_columns = ", ".join(
+            f"EXISTS (SELECT 1 FROM daily_progress WHERE user_id = u.id AND day_number = {day} AND completed = 1)"
+            for day in range(1, event_days + 1)
+        )
+        rows = 0
+        with open(path, "w", encoding="utf-8-sig", newline="") as f:
+            writer = csv.writer(f, delimiter=EXPORT_DELIMITER)
+            writer.writerow(export_columns(event_days))
+            # Курсор отдает строки порциями, вся таблица в память не загружается
+            async with self.conn.execute(f'''
+                SELECT u.id, u.username, u.full_name, u.points, u.results, {day_columns}, u.reflection
+                FROM users u ORDER BY u.id
+            ''') as cursor:
+                async for row in cursor:
+                    row = list(row)
+                    row[4] = EXPORT_RESULTS_SEPARATOR.join(_loads(row[4], [])) or None
+                    writer.writerow(row)
+                    rows += 1
+        return rows
+
+    # --- Прогресс по дням ---
+    async def get_day_progress(self, user_id, day_number):
+        return _loads(await self._fetchval('SELECT data FROM daily_progress WHERE user_id = ? AND day_number = ?', user_id, day_number), {})
+
+    async def _write_day_progress(self, conn, user_id, day_number, data, completed=None):
+        await conn.execute(
+            'INSERT INTO daily_progress (user_id, day_number, completed, data) VALUES (?, ?, COALESCE(?, 0), ?) '
+            'ON CONFLICT (user_id, day_number) DO UPDATE SET data = excluded.data, '
+            'completed = COALESCE(?, daily_progress.completed)',
+            (user_id, day_number, completed, _dumps(data), completed)
+        )
+
+    async def update_day_progress_data(self, user_id, day_number, new_data_dict):
+        async with self._transaction() as conn:
+            data = await self.get_day_progress(user_id, day_number)
+            data.update(new_data_dict)
+            await self._write_day_progress(conn, user_id, day_number, data)
+
+    async def append_day_progress_item(self, user_id, day_number, key, item, award_key=None, points=0):
+        async with self._transaction() as conn:
+            data = await self.get_day_progress(user_id, day_number)
+            items = data.setdefault(key, [])
+            if item in items:
+                return False
+            items.append(item)
+            await self._write_day_progress(conn, user_id, day_number, data)
+            if award_key is not None:
+                await self._award_points(conn, user_id, award_key, points)
+            return True
+
+    async def complete_day(self, user_id, day_number, points, result, reflection, progress, result_once):
+        async with self._transaction() as conn:
+            row = await self._fetchone('SELECT completed, data FROM daily_progress WHERE user_id = ? AND day_number = ?', user_id, day_number)
+            first_time = row is None or row['completed'] != 1
+            if first_time:
+                data = _loads(row['data'], {}) if row else {}
+                data.update(progress or {})
+                await self._write_day_progress(conn, user_id, day_number, data, completed=1)
+                if points:
+                    await self._award_points(conn, user_id, f"day{day_number}:complete", points)
+                if reflection is not None:
+                    await conn.execute('UPDATE users SET reflection = ? WHERE id = ?', (reflection, user_id))
+            if result is not None and (first_time or not result_once):
+                await self._add_result(conn, user_id, result)
+            return first_time
@@ -0,0 +1,89 @@
+"""
+Последовательная обработка обновлений одного пользователя.
+
+aiogram обрабатывает обновления параллельно, поэтому двойное нажатие кнопки запускает два
+обработчика одновременно, и оба видят еще не сохраненный прогресс и состояние. UserQueueMiddleware
+ставит обновления каждого пользователя в очередь: следующее начинает обрабатываться только
+после завершения предыдущего, включая сохранение состояния FSM. Обновления разных
+пользователей по-прежнему обрабатываются параллельно. Очередь пользователя существует, только
+пока в ней есть обновления, поэтому ушедшие пользователи память не занимают.
+"""
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.middlewares.user_context import EVENT_CONTEXT_KEY, EventContext
+from aiogram.types import Update
+
+
+class _UserQueue:
+    __slots__ = ("lock", "depth")
+
+    def __init__(self):
+        # asyncio.Lock пропускает ожидающих в порядке очереди
+        self.lock = asyncio.Lock()
+        # обновления в очереди, включая обрабатываемое
+        self.depth = 0
+
+
+# user_id -> очередь пользователя, у которого есть необработанные обновления
+_queues: dict[int, _UserQueue] = {}
+# Тип обновления (message, callback_query, ...) -> метрики очереди
+queue_stats: dict[str, dict] = {}
+
+
+def _stats_for(update_type: str) -> dict:
+    stats = queue_stats.get(update_type)
+    if stats is None:
+        stats = queue_stats[update_type] = {"updates": 0, "waited": 0, "wait_total": 0.0, "wait_max": 0.0, "depth_max": 0}
+    return stats
+
+
+def active_queues() -> tuple[int, int]:
+    """Число пользователей с необработанными обновлениями и общее число таких обновлений."""
+    return len(_queues), sum(queue.depth for queue in _queues.values())
+
+
+class UserQueueMiddleware(BaseMiddleware):
+    """
+    Подключается к dp.update.outer_middleware раньше FSM-middleware, чтобы состояние
+    следующего обновления читалось после сохранения предыдущего.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any],
+    ) -> Any:
+        event_context: EventContext | None = data.get(EVENT_CONTEXT_KEY)
+        user_id = event_context.user_id if event_context else None
+        if user_id is None:
+            return await handler(event, data)
+
+        queue = _queues.get(user_id)
+        if queue is None:
+            queue = _queues[user_id] = _UserQueue()
+        queue.depth += 1
+        stats = _stats_for(event.event_type)
+        stats["updates"] += 1
+        stats["depth_max"] = max(stats["depth_max"], queue.depth)
+        try:
+            if queue.lock.locked():
+                started = time.perf_counter()
+                await queue.lock.acquire()
+                waited = time.perf_counter() - started
+                stats["waited"] += 1
+                stats["wait_total"] += waited
+                stats["wait_max"] = max(stats["wait_max"], waited)
+            else:
+                await queue.lock.acquire()
+            try:
+                return await handler(event, data)
+            finally:
+                queue.lock.release()
+        finally:
+            queue.depth -= 1
+            if queue.depth == 0 and _queues.get(user_id) is queue:
+                del _queues[user_id]
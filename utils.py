@@ -20,6 +20,18 @@ async def safe_delete_message(message: types.Message):
     except Exception as e:
         logging.debug(f"Не удалось удалить сообщение: {e}")
 
+def message_ref(message: types.Message) -> list[int]:
+    """Ссылка на сообщение для хранения в состоянии FSM: [chat_id, message_id]."""
+    return [message.chat.id, message.message_id]
+
+async def safe_delete_ref(bot, ref: list[int]):
+    """Безопасно удаляет сообщение по ссылке из message_ref."""
+    chat_id, message_id = ref
+    try:
+        await bot.delete_message(chat_id, message_id)
+    except Exception as e:
+        logging.debug(f"Не удалось удалить сообщение: {e}")
+
 def parse_idx(cb_data: str) -> int | None:
     """Извлекает числовой индекс из данных колбэка (например, 'card:1' -> 1)."""
     if ":" not in cb_data: return None